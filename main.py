@@ -1,17 +1,38 @@
 import asyncio
+import bisect
+import csv
+import gzip
+import io
 import random
+import secrets
 import time
 import json
 import logging
 import os
+import sys
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from collections import defaultdict
+import struct
+import tempfile
+import queue
+import threading
+import functools
+from array import array
+import hmac
+import importlib.util
+import inspect
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import defaultdict, OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-from telegram.error import TelegramError, NetworkError, TimedOut, BadRequest
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+import httpx
+from telegram.error import TelegramError, NetworkError, TimedOut, BadRequest, RetryAfter, Forbidden
+from aiohttp import web
 
 # Setup logging
 logging.basicConfig(
@@ -24,163 +45,2354 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = "8461616896:AAFOfTm54k54G8kQVQf6nqSVVYClO6Z5EQg"
 OWNER_ID = 5802965692
 
+# Mode serving: "polling" (default) atau "webhook" (aiohttp server bawaan)
+RUN_MODE = os.getenv("BOT_RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Base URL publik, mis. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")  # Kosong = dibuat acak setiap start
+WEBHOOK_MAX_BODY = 1024 * 1024  # Batas ukuran body update (byte)
+WEBHOOK_MAX_CONNECTIONS = 40  # Koneksi paralel dari server Telegram
+HEALTH_PATH = "/healthz"
+
+# Transport HTTP ke Bot API (pool terpisah untuk get_updates, request biasa dan upload media)
+HTTP_POOL_SIZE = 32  # Koneksi paralel untuk send/edit/answer
+HTTP_MEDIA_POOL_SIZE = 8  # Koneksi paralel khusus upload file
+HTTP_GET_UPDATES_POOL_SIZE = 1  # Long poll cukup satu koneksi
+HTTP_KEEPALIVE_EXPIRY = 30.0  # Detik koneksi idle tetap dibuka
+HTTP2_ENABLED = False  # Butuh paket h2 (httpx[http2])
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 10.0
+HTTP_WRITE_TIMEOUT = 10.0
+HTTP_POOL_TIMEOUT = 5.0  # Batas tunggu slot koneksi sebelum TimedOut
+HTTP_MEDIA_READ_TIMEOUT = 30.0
+HTTP_MEDIA_WRITE_TIMEOUT = 60.0
+HTTP_GET_UPDATES_READ_TIMEOUT = 15.0
+
 # Database configuration
 DB_NAME = "hiragana_bot.db"
 
-# Data Hiragana lengkap dengan romaji
-HIRAGANA_DATA = {
-    'あ': 'a', 'い': 'i', 'う': 'u', 'え': 'e', 'お': 'o',
-    'か': 'ka', 'き': 'ki', 'く': 'ku', 'け': 'ke', 'こ': 'ko',
-    'が': 'ga', 'ぎ': 'gi', 'ぐ': 'gu', 'げ': 'ge', 'ご': 'go',
-    'さ': 'sa', 'し': 'shi', 'す': 'su', 'せ': 'se', 'そ': 'so',
-    'ざ': 'za', 'じ': 'ji', 'ず': 'zu', 'ぜ': 'ze', 'ぞ': 'zo',
-    'た': 'ta', 'ち': 'chi', 'つ': 'tsu', 'て': 'te', 'と': 'to',
-    'だ': 'da', 'ぢ': 'di', 'づ': 'du', 'で': 'de', 'ど': 'do',
-    'な': 'na', 'に': 'ni', 'ぬ': 'nu', 'ね': 'ne', 'の': 'no',
-    'は': 'ha', 'ひ': 'hi', 'ふ': 'fu', 'へ': 'he', 'ほ': 'ho',
-    'ば': 'ba', 'び': 'bi', 'ぶ': 'bu', 'べ': 'be', 'ぼ': 'bo',
-    'ぱ': 'pa', 'ぴ': 'pi', 'ぷ': 'pu', 'ぺ': 'pe', 'ぽ': 'po',
-    'ま': 'ma', 'み': 'mi', 'む': 'mu', 'め': 'me', 'も': 'mo',
-    'や': 'ya', 'ゆ': 'yu', 'よ': 'yo',
-    'ら': 'ra', 'り': 'ri', 'る': 'ru', 'れ': 're', 'ろ': 'ro',
-    'わ': 'wa', 'ゐ': 'wi', 'ゑ': 'we', 'を': 'wo', 'ん': 'n'
-}
+# Konfigurasi database executor
+DB_READ_WORKERS = 4  # Thread untuk query read
+DB_QUEUE_SIZE = 1000  # Batas operasi DB yang antri (backpressure)
+DB_POOL_SIZE = DB_READ_WORKERS + 2  # Koneksi long-lived (reader + writer + cadangan)
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KB = 16384  # Page cache per koneksi
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_STATEMENT_CACHE = 256  # Prepared statement yang disimpan per koneksi
+
+# Konfigurasi activity tracker (write-behind)
+ACTIVITY_FLUSH_INTERVAL = 5  # Flush setiap N detik
+ACTIVITY_FLUSH_EVENTS = 200  # ...atau setiap N event
+ACTIVITY_PROFILE_CACHE_SIZE = 20000  # Profil terakhir yang diingat (LRU); yang terbuang cukup ditulis ulang
+
+# Digest track record untuk owner
+TRACK_RECORD_DIGEST_INTERVAL = 300  # Kirim digest setiap N detik
+TRACK_RECORD_DIGEST_GAMES = 50  # ...atau setiap N game selesai
+TRACK_RECORD_MAX_PENDING = 5000  # Batas buffer kalau pengiriman terus gagal
+TRACK_RECORD_SUMMARY_LINES = 10  # Baris game yang ditampilkan di caption
+
+# Konfigurasi broadcast engine
+BROADCAST_RATE = 25  # Pesan per detik (batas global Telegram ~30/detik)
+BROADCAST_WORKERS = 8  # Worker pengirim paralel
+BROADCAST_BATCH_SIZE = 200  # Recipient yang diambil per query
+BROADCAST_RESULT_FLUSH = 50  # Simpan state recipient setiap N hasil
+BROADCAST_MAX_ATTEMPTS = 5  # Retry untuk error jaringan sementara
+BROADCAST_PROGRESS_INTERVAL = 5  # Edit pesan progress paling cepat tiap N detik
+
+# Antrian pesan keluar (prioritas + rate limit global dan per chat)
+OUTBOUND_WORKERS = 16  # Request keluar yang berjalan bersamaan
+OUTBOUND_GLOBAL_RATE = 30  # Pesan per detik untuk seluruh bot
+OUTBOUND_CHAT_RATE = 1.0  # Pesan per detik per chat...
+OUTBOUND_CHAT_BURST = 5  # ...dengan burst pendek
+OUTBOUND_SHED_DEPTH = 200  # Kelas terendah (broadcast) ditolak kalau antrian sedalam ini
+OUTBOUND_MAX_RETRIES = 3  # Retry setelah RetryAfter (selain broadcast)
+OUTBOUND_SHED_BACKOFF = 2  # Detik broadcast menunggu setelah ditolak
+
+# Data Hiragana lengkap dengan romaji
+HIRAGANA_DATA = {
+    'あ': 'a', 'い': 'i', 'う': 'u', 'え': 'e', 'お': 'o',
+    'か': 'ka', 'き': 'ki', 'く': 'ku', 'け': 'ke', 'こ': 'ko',
+    'が': 'ga', 'ぎ': 'gi', 'ぐ': 'gu', 'げ': 'ge', 'ご': 'go',
+    'さ': 'sa', 'し': 'shi', 'す': 'su', 'せ': 'se', 'そ': 'so',
+    'ざ': 'za', 'じ': 'ji', 'ず': 'zu', 'ぜ': 'ze', 'ぞ': 'zo',
+    'た': 'ta', 'ち': 'chi', 'つ': 'tsu', 'て': 'te', 'と': 'to',
+    'だ': 'da', 'ぢ': 'di', 'づ': 'du', 'で': 'de', 'ど': 'do',
+    'な': 'na', 'に': 'ni', 'ぬ': 'nu', 'ね': 'ne', 'の': 'no',
+    'は': 'ha', 'ひ': 'hi', 'ふ': 'fu', 'へ': 'he', 'ほ': 'ho',
+    'ば': 'ba', 'び': 'bi', 'ぶ': 'bu', 'べ': 'be', 'ぼ': 'bo',
+    'ぱ': 'pa', 'ぴ': 'pi', 'ぷ': 'pu', 'ぺ': 'pe', 'ぽ': 'po',
+    'ま': 'ma', 'み': 'mi', 'む': 'mu', 'め': 'me', 'も': 'mo',
+    'や': 'ya', 'ゆ': 'yu', 'よ': 'yo',
+    'ら': 'ra', 'り': 'ri', 'る': 'ru', 'れ': 're', 'ろ': 'ro',
+    'わ': 'wa', 'ゐ': 'wi', 'ゑ': 'we', 'を': 'wo', 'ん': 'n'
+}
+
+# Reverse mapping untuk mencari hiragana dari romaji
+ROMAJI_TO_HIRAGANA = {v: k for k, v in HIRAGANA_DATA.items()}
+
+# Pembagian level yang lebih seimbang
+LEVELS = {
+    1: ['あ', 'い', 'う', 'え', 'お', 'か', 'き', 'く', 'け', 'こ', 'さ', 'し'],
+    2: ['す', 'せ', 'そ', 'た', 'ち', 'つ', 'て', 'と', 'な', 'に', 'ぬ', 'ね'],
+    3: ['の', 'は', 'ひ', 'ふ', 'へ', 'ほ', 'ま', 'み', 'む', 'め', 'も', 'や'],
+    4: ['ゆ', 'よ', 'ら', 'り', 'る', 'れ', 'ろ', 'わ', 'を', 'ん', 'が', 'ぎ']
+}
+
+QUESTIONS_PER_QUIZ = 13
+DECK_GENERATOR_VERSION = 1  # Versi untuk deck baru; naikkan + daftarkan generator baru kalau urutan RNG berubah
+
+class QuestionFactory:
+    """Generator deck soal dengan tabel index dan distractor yang di-precompute"""
+    
+    OPTIONS_PER_QUESTION = 4
+    
+    def __init__(self, hiragana_data: Dict[str, str] = HIRAGANA_DATA, levels: Dict[int, List[str]] = LEVELS):
+        self.kana: Tuple[str, ...] = tuple(hiragana_data.keys())
+        self.romaji: Tuple[str, ...] = tuple(hiragana_data.values())
+        self.kana_index: Dict[str, int] = {char: i for i, char in enumerate(self.kana)}
+        kana_index = self.kana_index
+        
+        # Index karakter per level
+        self.level_indices: Dict[int, Tuple[int, ...]] = {
+            level: tuple(kana_index[char] for char in chars) for level, chars in levels.items()
+        }
+        
+        # Distractor mode easy: karakter lain di level yang sama (fallback: semua karakter lain)
+        all_indices = range(len(self.kana))
+        self.all_distractors: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(j for j in all_indices if j != i) for i in all_indices
+        )
+        self.level_distractors: Dict[int, Dict[int, Tuple[int, ...]]] = {}
+        for level, indices in self.level_indices.items():
+            self.level_distractors[level] = {
+                i: tuple(j for j in indices if j != i) or self.all_distractors[i] for i in indices
+            }
+        
+        # Generator per versi: game/checkpoint ber-seed hanya menyimpan (seed, versi), jadi generator
+        # yang sudah pernah dipakai tidak boleh diubah atau dihapus, cukup tambah versi baru
+        self.deck_generators: Dict[int, Callable] = {
+            1: self._generate_compact_v1,
+        }
+    
+    def draw_characters(self, level: int, size: int, rng) -> List[int]:
+        """Pilih karakter tanpa duplikat, ulangi pool kalau soal lebih banyak dari karakter"""
+        pool = self.level_indices[level]
+        drawn: List[int] = []
+        while len(drawn) < size:
+            batch = list(pool)
+            rng.shuffle(batch)
+            drawn.extend(batch)
+        return drawn[:size]
+    
+    def generate_compact(self, level: int, mode: str, size: int = QUESTIONS_PER_QUIZ, rng=random,
+                         version: int = DECK_GENERATOR_VERSION) -> Tuple[bytes, bytes]:
+        """Generate deck sebagai ID kana: (karakter per soal, opsi mc per soal / karakter yang ditampilkan tf)"""
+        generator = self.deck_generators.get(version)
+        if generator is None:
+            raise ValueError(f"Deck generator version {version} is not registered "
+                             f"(known: {sorted(self.deck_generators)})")
+        return generator(level, mode, size, rng)
+    
+    def _generate_compact_v1(self, level: int, mode: str, size: int, rng) -> Tuple[bytes, bytes]:
+        """Generator versi 1 (beku)"""
+        chars = self.draw_characters(level, size, rng)
+        
+        if mode == "easy":
+            distractors = self.level_distractors[level]
+            extra = bytearray()
+            for i in chars:
+                options = rng.sample(distractors[i], self.OPTIONS_PER_QUESTION - 1)
+                options.insert(rng.randrange(self.OPTIONS_PER_QUESTION), i)
+                extra += bytes(options)
+        else:
+            # Hard mode: keputusan true/false untuk seluruh deck sekaligus
+            truths = [rng.random() < 0.5 for _ in chars]
+            all_distractors = self.all_distractors
+            extra = bytearray(i if is_true else rng.choice(all_distractors[i]) for i, is_true in zip(chars, truths))
+        
+        return bytes(chars), bytes(extra)
+    
+    @staticmethod
+    def new_seed() -> int:
+        """Seed deck baru (muat di INTEGER SQLite)"""
+        return random.getrandbits(63)
+    
+    def deck_from_seed(self, level: int, mode: str, seed: int, version: int = DECK_GENERATOR_VERSION,
+                       size: int = QUESTIONS_PER_QUIZ) -> Tuple[bytes, bytes]:
+        """Generate ulang deck yang sama persis dari (level, mode, seed, versi)"""
+        return self.generate_compact(level, mode, size, random.Random(seed), version)
+    
+    def render_question(self, mode: str, chars: bytes, extra: bytes, n: int) -> Dict:
+        """Petakan soal ke-n dari ID kana kembali ke dict untuk ditampilkan"""
+        i = chars[n]
+        if mode == "easy":
+            stride = self.OPTIONS_PER_QUESTION
+            options = extra[n * stride:(n + 1) * stride]
+            return {
+                'type': 'multiple_choice',
+                'romaji': self.romaji[i],
+                'correct_hiragana': self.kana[i],
+                'options_hiragana': [self.kana[j] for j in options],
+                'correct_index': options.index(i)
+            }
+        displayed = extra[n]
+        return {
+            'type': 'true_false',
+            'romaji': self.romaji[i],
+            'correct_hiragana': self.kana[i],
+            'displayed_hiragana': self.kana[displayed],
+            'is_correct': displayed == i
+        }
+    
+    def generate_deck(self, level: int, mode: str, size: int = QUESTIONS_PER_QUIZ, rng=random) -> List[Dict]:
+        """Generate satu deck soal lengkap dalam bentuk dict"""
+        chars, extra = self.generate_compact(level, mode, size, rng)
+        return [self.render_question(mode, chars, extra, n) for n in range(len(chars))]
+    
+    def pack_deck(self, mode: str, chars: bytes, extra: bytes) -> str:
+        """Encode deck ke JSON ringkas (index kana) untuk checkpoint"""
+        if mode == "easy":
+            stride = self.OPTIONS_PER_QUESTION
+            packed = [[i, list(extra[n * stride:(n + 1) * stride])] for n, i in enumerate(chars)]
+        else:
+            packed = [[i, extra[n]] for n, i in enumerate(chars)]
+        return json.dumps(packed, separators=(',', ':'))
+    
+    def unpack_deck(self, data: str) -> Tuple[bytes, bytes]:
+        """Kebalikan dari pack_deck"""
+        chars = bytearray()
+        extra = bytearray()
+        for i, options in json.loads(data):
+            chars.append(i)
+            if isinstance(options, list):
+                extra += bytes(options)
+            else:
+                extra.append(options)
+        return bytes(chars), bytes(extra)
+    
+    def benchmark(self, iterations: int = 10000, level: int = 1, mode: str = "easy") -> Dict[str, float]:
+        """Ukur biaya generate deck (untuk profiling)"""
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            self.generate_deck(level, mode, rng=rng)
+        elapsed = time.perf_counter() - start
+        return {
+            'iterations': iterations,
+            'total_seconds': elapsed,
+            'us_per_deck': elapsed / iterations * 1_000_000,
+            'decks_per_second': iterations / elapsed if elapsed > 0 else float('inf')
+        }
+
+QUESTION_FACTORY = QuestionFactory()
+
+GAME_RECORD_VERSION = 1  # Versi encoding biner questions_data/answers_data
+
+class GameRecordCodec:
+    """Encoding biner ringkas untuk questions_data/answers_data di game_history"""
+    # questions: [versi, jumlah] + per soal [tipe, kana, ...] (mc: jumlah opsi + kana opsi, tf: kana ditampilkan)
+    # answers:   [versi, jumlah] + bit benar/salah + pilihan per jawaban + offset waktu (ms, uint32 LE)
+    TYPE_MC = 0
+    TYPE_TF = 1
+    NO_CHOICE = 0xFF
+    
+    def __init__(self, factory: QuestionFactory = QUESTION_FACTORY):
+        self.factory = factory
+    
+    def encode_questions(self, questions: List[Dict]) -> bytes:
+        kana_index = self.factory.kana_index
+        out = bytearray((GAME_RECORD_VERSION, len(questions)))
+        for question in questions:
+            if question['type'] == 'multiple_choice':
+                options = question['options_hiragana']
+                out += bytes((self.TYPE_MC, kana_index[question['correct_hiragana']], len(options)))
+                out += bytes(kana_index[char] for char in options)
+            else:
+                out += bytes((self.TYPE_TF, kana_index[question['correct_hiragana']],
+                              kana_index[question['displayed_hiragana']]))
+        return bytes(out)
+    
+    def decode_questions(self, data) -> List[Dict]:
+        """Kebalikan encode_questions (row lama berformat JSON tetap bisa dibaca)"""
+        if isinstance(data, str):
+            return json.loads(data)
+        kana = self.factory.kana
+        romaji = self.factory.romaji
+        self._check_version(data)
+        questions = []
+        pos = 2
+        for _ in range(data[1]):
+            kind, i = data[pos], data[pos + 1]
+            if kind == self.TYPE_MC:
+                count = data[pos + 2]
+                options = [kana[j] for j in data[pos + 3:pos + 3 + count]]
+                questions.append({
+                    'type': 'multiple_choice',
+                    'romaji': romaji[i],
+                    'correct_hiragana': kana[i],
+                    'options_hiragana': options,
+                    'correct_index': options.index(kana[i])
+                })
+                pos += 3 + count
+            else:
+                displayed = data[pos + 2]
+                questions.append({
+                    'type': 'true_false',
+                    'romaji': romaji[i],
+                    'correct_hiragana': kana[i],
+                    'displayed_hiragana': kana[displayed],
+                    'is_correct': displayed == i
+                })
+                pos += 3
+        return questions
+    
+    def encode_answers(self, questions: List[Dict], answers: List[Dict], start_time: float) -> bytes:
+        count = len(answers)
+        bits = bytearray((count + 7) // 8)
+        choices = bytearray(count)
+        offsets = []
+        for i, answer in enumerate(answers):
+            question = answer.get('question') or questions[i]
+            if answer['is_correct']:
+                bits[i >> 3] |= 1 << (i & 7)
+            user_answer = answer['user_answer']
+            if question['type'] == 'multiple_choice':
+                options = question['options_hiragana']
+                choices[i] = options.index(user_answer) if user_answer in options else self.NO_CHOICE
+            else:
+                choices[i] = 1 if user_answer == 'true' else 0
+            offsets.append(min(max(int((answer['timestamp'] - start_time) * 1000), 0), 0xFFFFFFFF))
+        return bytes((GAME_RECORD_VERSION, count)) + bytes(bits) + bytes(choices) + struct.pack(f'<{count}I', *offsets)
+    
+    def decode_answers(self, data, questions: List[Dict], start_time: float = 0.0) -> List[Dict]:
+        """Kebalikan encode_answers; timestamp = start_time + offset"""
+        if isinstance(data, str):
+            return json.loads(data)
+        self._check_version(data)
+        count = data[1]
+        bits_end = 2 + (count + 7) // 8
+        choices = data[bits_end:bits_end + count]
+        offsets = struct.unpack_from(f'<{count}I', data, bits_end + count)
+        answers = []
+        for i in range(count):
+            question = questions[i]
+            choice = choices[i]
+            if question['type'] == 'multiple_choice':
+                user_answer = question['options_hiragana'][choice] if choice != self.NO_CHOICE else None
+            else:
+                user_answer = 'true' if choice else 'false'
+            answers.append({
+                'question': question,
+                'user_answer': user_answer,
+                'is_correct': bool(data[2 + (i >> 3)] >> (i & 7) & 1),
+                'timestamp': start_time + offsets[i] / 1000
+            })
+        return answers
+    
+    def correctness(self, data) -> str:
+        """String benar/salah ('1'/'0') per jawaban tanpa decode soal"""
+        if not data:
+            return ''
+        if isinstance(data, str):
+            return ''.join('1' if answer.get('is_correct') else '0' for answer in json.loads(data))
+        self._check_version(data)
+        return ''.join('1' if data[2 + (i >> 3)] >> (i & 7) & 1 else '0' for i in range(data[1]))
+    
+    def questions_text(self, questions_data, level: int, mode: str,
+                       deck_seed: Optional[int] = None, deck_version: Optional[int] = None) -> str:
+        """Soal sebuah game_history sebagai teks: 'benar:opsi' (mc) atau 'benar:ditampilkan' (tf), dipisah spasi"""
+        questions = self.questions_for(questions_data, level, mode, deck_seed, deck_version)
+        return ' '.join(
+            question['correct_hiragana'] + ':' + (''.join(question['options_hiragana'])
+                                                  if question['type'] == 'multiple_choice'
+                                                  else question['displayed_hiragana'])
+            for question in questions
+        )
+    
+    def questions_for(self, questions_data, level: int, mode: str,
+                      deck_seed: Optional[int] = None, deck_version: Optional[int] = None) -> List[Dict]:
+        """Soal sebuah game_history: dari seed kalau ada, kalau tidak dari questions_data"""
+        if deck_seed is not None:
+            chars, extra = self.factory.deck_from_seed(level, mode, deck_seed, deck_version)
+            return [self.factory.render_question(mode, chars, extra, n) for n in range(len(chars))]
+        return self.decode_questions(questions_data)
+    
+    @staticmethod
+    def _check_version(data: bytes):
+        if not data or data[0] != GAME_RECORD_VERSION:
+            raise ValueError(f"Unsupported game record version: {data[0] if data else None}")
+    
+    def benchmark(self, iterations: int = 2000, level: int = 1, mode: str = "easy") -> Dict[str, float]:
+        """Bandingkan ukuran dan throughput encoding biner vs JSON lama"""
+        rng = random.Random(0)
+        start_time = time.time()
+        games = []
+        for _ in range(100):
+            questions = self.factory.generate_deck(level, mode, rng=rng)
+            answers = []
+            for i, question in enumerate(questions):
+                if question['type'] == 'multiple_choice':
+                    user_answer = rng.choice(question['options_hiragana'])
+                    is_correct = user_answer == question['correct_hiragana']
+                else:
+                    user_answer = rng.choice(('true', 'false'))
+                    is_correct = (user_answer == 'true') == question['is_correct']
+                answers.append({'question': question, 'user_answer': user_answer,
+                                'is_correct': is_correct, 'timestamp': start_time + i * 7.25})
+            games.append((questions, answers))
+        
+        def measure(encode, decode):
+            encoded = [encode(questions, answers) for questions, answers in games]
+            size = sum(len(q) + len(a) for q, a in encoded) / len(encoded)
+            t0 = time.perf_counter()
+            for n in range(iterations):
+                encode(*games[n % len(games)])
+            t1 = time.perf_counter()
+            for n in range(iterations):
+                decode(*encoded[n % len(encoded)])
+            t2 = time.perf_counter()
+            return size, iterations / (t1 - t0), iterations / (t2 - t1)
+        
+        json_size, json_enc, json_dec = measure(
+            lambda q, a: (json.dumps(q), json.dumps(a)),
+            lambda q, a: (json.loads(q), json.loads(a))
+        )
+        
+        def decode_binary(q, a):
+            questions = self.decode_questions(q)
+            return questions, self.decode_answers(a, questions, start_time)
+        
+        bin_size, bin_enc, bin_dec = measure(
+            lambda q, a: (self.encode_questions(q), self.encode_answers(q, a, start_time)),
+            decode_binary
+        )
+        return {
+            'iterations': iterations,
+            'json_bytes_per_game': json_size,
+            'binary_bytes_per_game': bin_size,
+            'size_ratio': json_size / bin_size,
+            'json_encodes_per_second': json_enc,
+            'binary_encodes_per_second': bin_enc,
+            'json_decodes_per_second': json_dec,
+            'binary_decodes_per_second': bin_dec
+        }
+
+GAME_RECORD_CODEC = GameRecordCodec()
+
+# Konfigurasi concurrency update
+MAX_CONCURRENT_UPDATES = 64  # Batas handler yang berjalan bersamaan
+NEXT_QUESTION_DELAY = 2  # Jeda (detik) sebelum soal berikutnya ditampilkan
+QUESTION_RENDER_MODE = "edit"  # "edit" = soal berikutnya mengganti pesan yang sama, "resend" = hapus + kirim baru
+ANSWER_FEEDBACK_MODE = "inline"  # "inline" = hasil di toast + caption soal berikutnya, "message" = pesan hasil + jeda
+
+# Konfigurasi session store
+QUIZ_TIME_LIMIT = 180  # Detik per quiz
+SESSION_TTL_GRACE = 60  # Session dibuang N detik setelah time limit habis
+SESSION_MAX_LIVE = 10000  # Batas session aktif (LRU)
+SESSION_SWEEP_INTERVAL = 30  # Interval sweeper (detik)
+STATS_CACHE_SIZE = 20000  # Statistik user yang disimpan di memori (LRU)
+LEADERBOARD_TOP_K = 10  # Baris yang ditampilkan di /leaderboard
+USER_LIST_PAGE_SIZE = 10  # Entri per halaman /userlist (nama terpanjang ~300 karakter, tetap di bawah 4096)
+
+# Konfigurasi /export (streaming ke file gzip, memori konstan)
+EXPORT_FETCH_SIZE = 2000  # Row per fetchmany
+EXPORT_MAX_BYTES = 50 * 1024 * 1024  # Batas upload dokumen Bot API
+EXPORT_UPLOAD_MIN_RATE = 256 * 1024  # Byte/detik terlambat yang masih ditoleransi saat upload (menentukan write_timeout)
+EXPORT_UPLOAD_READ_TIMEOUT = 120.0  # Telegram memproses file besar sebelum membalas
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Tabel yang bisa di-export: (query, kolom filter tanggal, tipe kolom tanggal 'epoch'/'text')
+# Sengaja tanpa ORDER BY: hasil di-stream langsung dari scan tabel/index tanpa sort di memori
+EXPORT_TABLES = {
+    'users': ('''
+        SELECT user_id, username, first_name, last_name, language_code,
+               created_at, last_active, total_messages, status
+        FROM users
+    ''', 'last_active', 'text'),
+    'stats': ('''
+        SELECT user_id, total_games, total_questions, total_correct,
+               best_score_level1, best_score_level2, best_score_level3, best_score_level4,
+               level1_plays, level2_plays, level3_plays, level4_plays,
+               easy_games, hard_games, easy_correct, hard_correct, easy_total, hard_total,
+               total_time_played, average_score, best_streak, current_streak, first_play, last_play
+        FROM user_stats
+    ''', 'last_play_ts', 'epoch'),
+    'games': ('''
+        SELECT id, user_id, level, mode, score, total_questions, percentage, duration, grade,
+               deck_seed, deck_version, played_at, questions_data, answers_data
+        FROM game_history
+    ''', 'played_at', 'epoch'),
+}
+
+# Storage untuk user data
+user_statistics: Dict[int, Dict] = {}
+
+class QuizSession:
+    """State satu quiz yang sedang berjalan (soal dan jawaban disimpan sebagai ID kana dalam buffer)"""
+    __slots__ = ('user_id', 'chat_id', 'username', 'display_name', 'language_code', 'level', 'mode', 'seed', 'deck_version', 'chars', 'extra',
+                 'current_question', 'score', 'start_time', 'time_limit', 'choices', 'correct', 'answer_ms')
+    
+    def __init__(self, user_id: int, chat_id: int, user_info: Dict, level: int, mode: str,
+                 chars: bytes, extra: bytes, time_limit: int = QUIZ_TIME_LIMIT,
+                 seed: Optional[int] = None, deck_version: Optional[int] = None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        # Dari profil Telegram cukup yang dipakai hasil akhir dan digest owner
+        self.username = user_info.get('username', 'Unknown')
+        self.display_name = user_info.get('full_name') or user_info.get('first_name') or 'Unknown'
+        self.language_code = user_info.get('language_code', '')
+        self.level = level
+        self.mode = mode
+        self.seed = seed  # Deck bisa dibangun ulang dari (level, mode, seed, deck_version)
+        self.deck_version = deck_version
+        self.chars = chars  # ID kana per soal
+        self.extra = extra  # Opsi mc (4 per soal) atau karakter yang ditampilkan (tf)
+        self.current_question = 0
+        self.score = 0
+        self.start_time = time.time()
+        self.time_limit = time_limit
+        self.choices = bytearray()  # Index opsi (mc) atau 1/0 untuk true/false
+        self.correct = bytearray()
+        self.answer_ms = array('I')  # Offset waktu jawaban dari start_time
+    
+    @property
+    def user_info(self) -> Dict:
+        """Profil dalam format dict get_user_info (untuk checkpoint dan digest)"""
+        return {
+            'id': self.user_id,
+            'username': self.username,
+            'full_name': self.display_name,
+            'language_code': self.language_code
+        }
+    
+    @property
+    def question_count(self) -> int:
+        return len(self.chars)
+    
+    @property
+    def answer_count(self) -> int:
+        return len(self.choices)
+    
+    def question(self, n: int) -> Dict:
+        """Soal ke-n dalam bentuk dict (dibangun saat ditampilkan)"""
+        return QUESTION_FACTORY.render_question(self.mode, self.chars, self.extra, n)
+    
+    @property
+    def questions(self) -> List[Dict]:
+        return [self.question(n) for n in range(len(self.chars))]
+    
+    def answer(self, n: int, question: Optional[Dict] = None) -> Dict:
+        """Jawaban ke-n dalam format dict lama"""
+        if question is None:
+            question = self.question(n)
+        choice = self.choices[n]
+        if question['type'] == 'multiple_choice':
+            user_answer = question['options_hiragana'][choice]
+        else:
+            user_answer = 'true' if choice else 'false'
+        return {
+            'question': question,
+            'user_answer': user_answer,
+            'is_correct': bool(self.correct[n]),
+            'timestamp': self.start_time + self.answer_ms[n] / 1000
+        }
+    
+    @property
+    def user_answers(self) -> List[Dict]:
+        return [self.answer(n) for n in range(len(self.choices))]
+    
+    def record_answer(self, choice: int, is_correct: bool, timestamp: float):
+        self.choices.append(choice)
+        self.correct.append(1 if is_correct else 0)
+        self.answer_ms.append(min(max(int((timestamp - self.start_time) * 1000), 0), 0xFFFFFFFF))
+    
+    @classmethod
+    def from_seed(cls, user_id: int, chat_id: int, user_info: Dict, level: int, mode: str,
+                  seed: int, deck_version: int = DECK_GENERATOR_VERSION) -> 'QuizSession':
+        chars, extra = QUESTION_FACTORY.deck_from_seed(level, mode, seed, deck_version)
+        return cls(user_id, chat_id, user_info, level, mode, chars, extra, seed=seed, deck_version=deck_version)
+    
+    def checkpoint_row(self) -> Tuple:
+        """Row lengkap untuk tabel quiz_session_state (deck cukup seed-nya kalau ada)"""
+        answers = ''.join(self.pack_answer(n) for n in range(self.answer_count))
+        deck = None if self.seed is not None else QUESTION_FACTORY.pack_deck(self.mode, self.chars, self.extra)
+        return (self.user_id, self.chat_id, json.dumps(self.user_info), self.level, self.mode,
+                deck, self.seed, self.deck_version, self.current_question, self.score,
+                self.start_time, self.time_limit, answers)
+    
+    def pack_answer(self, n: int) -> str:
+        """Jawaban ke-n dalam bentuk ringkas (satu baris, bisa di-append)"""
+        answer = self.answer(n)
+        return json.dumps([answer['user_answer'], int(answer['is_correct']), round(answer['timestamp'], 3)],
+                          separators=(',', ':')) + '\n'
+    
+    @classmethod
+    def from_checkpoint(cls, row: Tuple) -> 'QuizSession':
+        """Bangun ulang session dari row quiz_session_state"""
+        (user_id, chat_id, user_info, level, mode, questions, deck_seed, deck_version,
+         current_question, score, start_time, time_limit, answers, paused_at) = row
+        if deck_seed is not None:
+            chars, extra = QUESTION_FACTORY.deck_from_seed(level, mode, deck_seed, deck_version)
+        else:
+            chars, extra = QUESTION_FACTORY.unpack_deck(questions)
+        session = cls(user_id, chat_id, json.loads(user_info), level, mode, chars, extra, time_limit,
+                      seed=deck_seed, deck_version=deck_version)
+        session.current_question = current_question
+        session.score = score
+        session.start_time = start_time
+        for n, line in enumerate((answers or '').splitlines()):
+            user_answer, is_correct, timestamp = json.loads(line)
+            question = session.question(n)
+            if question['type'] == 'multiple_choice':
+                choice = question['options_hiragana'].index(user_answer)
+            else:
+                choice = 1 if user_answer == 'true' else 0
+            session.record_answer(choice, is_correct, timestamp)
+        # Waktu selama bot mati (shutdown normal) tidak dihitung
+        if paused_at:
+            session.start_time += time.time() - paused_at
+        return session
+    
+    def expires_at(self, grace: float = SESSION_TTL_GRACE) -> float:
+        """Waktu session boleh dibuang (time limit + grace)"""
+        return self.start_time + self.time_limit + grace
+    
+    def estimate_size(self) -> int:
+        """Perkiraan memori (bytes) yang dipakai session ini"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.username) + sys.getsizeof(self.display_name)
+                + sys.getsizeof(self.chars) + sys.getsizeof(self.extra)
+                + sys.getsizeof(self.choices) + sys.getsizeof(self.correct) + sys.getsizeof(self.answer_ms))
+
+class SessionStore:
+    """Store session quiz dengan batas ukuran (LRU) dan TTL"""
+    
+    def __init__(self, max_size: int = SESSION_MAX_LIVE, grace: float = SESSION_TTL_GRACE):
+        self.max_size = max_size
+        self.grace = grace
+        self._sessions: OrderedDict = OrderedDict()
+    
+    def get(self, user_id: int) -> Optional[QuizSession]:
+        """Ambil session dan tandai sebagai baru dipakai"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self._sessions.move_to_end(user_id)
+        return session
+    
+    def put(self, session: QuizSession) -> Optional[QuizSession]:
+        """Simpan session, return session lama yang dibuang kalau store penuh"""
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        if len(self._sessions) > self.max_size:
+            _, evicted = self._sessions.popitem(last=False)
+            return evicted
+        return None
+    
+    def pop(self, user_id: int) -> Optional[QuizSession]:
+        return self._sessions.pop(user_id, None)
+    
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def pop_expired(self, now: float) -> List[QuizSession]:
+        """Lepas semua session yang sudah lewat TTL"""
+        expired = [user_id for user_id, session in self._sessions.items()
+                   if session.expires_at(self.grace) <= now]
+        return [self._sessions.pop(user_id) for user_id in expired]
+    
+    def stats(self) -> Dict[str, int]:
+        """Jumlah session aktif dan perkiraan memori"""
+        return {
+            'live': len(self._sessions),
+            'max_size': self.max_size,
+            'memory_bytes': sum(session.estimate_size() for session in self._sessions.values())
+        }
+
+class UserStats:
+    """Statistik satu user (slotted, disimpan di UserStatsCache)"""
+    __slots__ = ('user_id', 'total_games', 'total_questions', 'total_correct', 'best_scores', 'level_plays',
+                 'mode_games', 'mode_correct', 'mode_total', 'total_time_played', 'average_score',
+                 'best_streak', 'current_streak', 'first_play', 'last_play')
+    
+    def __init__(self, user_id: int):
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self.user_id = user_id
+        self.total_games = 0
+        self.total_questions = 0
+        self.total_correct = 0
+        self.best_scores: Dict[int, int] = {level: 0 for level in LEVELS}
+        self.level_plays: Dict[int, int] = {level: 0 for level in LEVELS}
+        self.mode_games: Dict[str, int] = {'easy': 0, 'hard': 0}
+        self.mode_correct: Dict[str, int] = {'easy': 0, 'hard': 0}
+        self.mode_total: Dict[str, int] = {'easy': 0, 'hard': 0}
+        self.total_time_played = 0
+        self.average_score = 0.0
+        self.best_streak = 0
+        self.current_streak = 0
+        self.first_play = now
+        self.last_play = now
+    
+    @classmethod
+    def from_row(cls, row: Tuple) -> 'UserStats':
+        """Bangun dari row SELECT * FROM user_stats"""
+        stats = cls(row[1])
+        stats.total_games = row[2] or 0
+        stats.total_questions = row[3] or 0
+        stats.total_correct = row[4] or 0
+        stats.best_scores = {1: row[5] or 0, 2: row[6] or 0, 3: row[7] or 0, 4: row[8] or 0}
+        stats.level_plays = {1: row[9] or 0, 2: row[10] or 0, 3: row[11] or 0, 4: row[12] or 0}
+        stats.mode_games = {'easy': row[13] or 0, 'hard': row[14] or 0}
+        stats.mode_correct = {'easy': row[15] or 0, 'hard': row[16] or 0}
+        stats.mode_total = {'easy': row[17] or 0, 'hard': row[18] or 0}
+        stats.total_time_played = row[19] or 0
+        stats.average_score = float(row[20] or 0.0)
+        stats.best_streak = row[21] or 0
+        stats.current_streak = row[22] or 0
+        stats.first_play = row[23] or stats.first_play
+        stats.last_play = row[24] or stats.last_play
+        return stats
+    
+    def copy(self) -> 'UserStats':
+        clone = UserStats.__new__(UserStats)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            setattr(clone, name, dict(value) if isinstance(value, dict) else value)
+        return clone
+    
+    def to_dict(self) -> Dict:
+        """Format dict yang dipakai handler"""
+        return {
+            'user_id': self.user_id,
+            'total_games': self.total_games,
+            'total_questions': self.total_questions,
+            'total_correct': self.total_correct,
+            'best_scores': dict(self.best_scores),
+            'level_plays': dict(self.level_plays),
+            'mode_stats': {
+                mode: {
+                    'games': self.mode_games[mode],
+                    'correct': self.mode_correct[mode],
+                    'total': self.mode_total[mode]
+                } for mode in ('easy', 'hard')
+            },
+            'total_time_played': self.total_time_played,
+            'average_score': self.average_score,
+            'best_streak': self.best_streak,
+            'current_streak': self.current_streak,
+            'first_play': self.first_play,
+            'last_play': self.last_play
+        }
+
+class UserStatsCache:
+    """Cache LRU statistik user: read-through dari DB, write-through dari update_user_stats"""
+    
+    def __init__(self, max_size: int = STATS_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, user_id: int) -> Optional[UserStats]:
+        stats = self._entries.get(user_id)
+        if stats is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(user_id)
+        return stats
+    
+    def peek(self, user_id: int) -> Optional[UserStats]:
+        """Ambil tanpa menghitung hit/miss"""
+        return self._entries.get(user_id)
+    
+    def write_token(self) -> int:
+        """Token sebelum read DB, dipakai fill() untuk menolak hasil read yang basi"""
+        return self._writes
+    
+    def fill(self, user_id: int, stats: UserStats, token: int):
+        """Isi dari hasil read, kecuali sudah ada write sejak read dimulai"""
+        if token == self._writes:
+            self._store(user_id, stats)
+    
+    def put(self, user_id: int, stats: UserStats):
+        """Write-through setelah statistik di-update"""
+        self._writes += 1
+        self._store(user_id, stats)
+    
+    def invalidate(self, user_id: int):
+        self._writes += 1
+        self._entries.pop(user_id, None)
+    
+    def clear(self):
+        self._writes += 1
+        self._entries.clear()
+    
+    def _store(self, user_id: int, stats: UserStats):
+        self._entries[user_id] = stats
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups * 100 if lookups else 0.0
+        }
+
+class LeaderboardIndex:
+    """Ranking in-memory (list key terurut + bisect) untuk overall dan tiap level"""
+    
+    OVERALL = 'overall'
+    
+    def __init__(self):
+        self.boards = (self.OVERALL,) + tuple(LEVELS)
+        self._keys: Dict = {board: [] for board in self.boards}
+        self._user_keys: Dict = {board: {} for board in self.boards}
+        self.names: Dict[int, str] = {}
+    
+    @staticmethod
+    def clean_name(name: Optional[str]) -> str:
+        """Buang karakter Markdown supaya satu nama tidak merusak seluruh pesan"""
+        return ''.join(ch for ch in (name or '') if ch not in '*_`[]').strip() or 'Unknown'
+    
+    @staticmethod
+    def overall_key(user_id: int, total_games: int, total_questions: int, total_correct: int) -> Optional[Tuple]:
+        """Akurasi tertinggi dulu, seri dipecah jumlah game lalu user_id"""
+        if not total_questions:
+            return None
+        return (-total_correct / total_questions, -total_games, user_id)
+    
+    @staticmethod
+    def level_key(user_id: int, best_score: int, plays: int) -> Optional[Tuple]:
+        """Best score tertinggi dulu, seri dipecah jumlah main lalu user_id"""
+        if not plays:
+            return None
+        return (-best_score, -plays, user_id)
+    
+    def load(self, rows) -> int:
+        """Bangun ulang semua board dari row (user_id, games, questions, correct, best1-4, plays1-4, first, last)"""
+        keys: Dict = {board: [] for board in self.boards}
+        user_keys: Dict = {board: {} for board in self.boards}
+        names: Dict[int, str] = {}
+        for row in rows:
+            user_id = row[0]
+            names[user_id] = self.clean_name(f"{row[12] or ''} {row[13] or ''}")
+            entries = [(self.OVERALL, self.overall_key(user_id, row[1] or 0, row[2] or 0, row[3] or 0))]
+            entries += [(level, self.level_key(user_id, row[3 + level] or 0, row[7 + level] or 0)) for level in LEVELS]
+            for board, key in entries:
+                if key is not None:
+                    keys[board].append(key)
+                    user_keys[board][user_id] = key
+        for board in self.boards:
+            keys[board].sort()
+        self._keys, self._user_keys, self.names = keys, user_keys, names
+        return len(names)
+    
+    def update(self, stats: UserStats, name: Optional[str] = None):
+        """Pindahkan posisi user di semua board setelah game selesai (cari posisi O(log n))"""
+        if name is not None or stats.user_id not in self.names:
+            self.names[stats.user_id] = self.clean_name(name)
+        self._set(self.OVERALL, stats.user_id, self.overall_key(
+            stats.user_id, stats.total_games, stats.total_questions, stats.total_correct))
+        for level in LEVELS:
+            self._set(level, stats.user_id, self.level_key(
+                stats.user_id, stats.best_scores.get(level, 0), stats.level_plays.get(level, 0)))
+    
+    def _set(self, board, user_id: int, key: Optional[Tuple]):
+        keys = self._keys[board]
+        old = self._user_keys[board].get(user_id)
+        if old == key:
+            return
+        if old is not None:
+            del keys[bisect.bisect_left(keys, old)]
+            del self._user_keys[board][user_id]
+        if key is not None:
+            bisect.insort(keys, key)
+            self._user_keys[board][user_id] = key
+    
+    def top(self, board, k: int = LEADERBOARD_TOP_K) -> List[Tuple[int, int, str, Tuple]]:
+        """Top-k sebagai (rank, user_id, name, key)"""
+        return [(rank, key[-1], self.names.get(key[-1], 'Unknown'), key)
+                for rank, key in enumerate(self._keys[board][:k], 1)]
+    
+    def rank(self, board, user_id: int) -> Optional[int]:
+        """Peringkat user (1-based) atau None kalau belum masuk board"""
+        key = self._user_keys[board].get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._keys[board], key) + 1
+    
+    def entry(self, board, user_id: int) -> Optional[Tuple]:
+        return self._user_keys[board].get(user_id)
+    
+    def size(self, board) -> int:
+        return len(self._keys[board])
+
+class UserUpdateSerializer:
+    """Lock per user supaya update dari user yang sama tetap berurutan"""
+    
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = defaultdict(int)
+    
+    @asynccontextmanager
+    async def lock(self, user_id: int):
+        """Ambil lock milik user, dibuang lagi kalau sudah tidak dipakai"""
+        user_lock = self._locks.get(user_id)
+        if user_lock is None:
+            user_lock = self._locks[user_id] = asyncio.Lock()
+        self._waiters[user_id] += 1
+        try:
+            async with user_lock:
+                yield
+        finally:
+            self._waiters[user_id] -= 1
+            if self._waiters[user_id] <= 0:
+                self._waiters.pop(user_id, None)
+                self._locks.pop(user_id, None)
+    
+    def active_users(self) -> int:
+        """Jumlah user yang sedang punya update dalam proses"""
+        return len(self._locks)
+
+def _migration_base_tables(cursor: sqlite3.Cursor):
+    """Tabel dasar bot"""
+    # Tabel users dengan informasi tambahan
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            is_bot INTEGER DEFAULT 0,
+            language_code TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_active DATETIME DEFAULT CURRENT_TIMESTAMP,
+            total_messages INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'active'
+        )
+    ''')
+    
+    # Tabel user_stats dengan detail lengkap
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            total_games INTEGER DEFAULT 0,
+            total_questions INTEGER DEFAULT 0,
+            total_correct INTEGER DEFAULT 0,
+            best_score_level1 INTEGER DEFAULT 0,
+            best_score_level2 INTEGER DEFAULT 0,
+            best_score_level3 INTEGER DEFAULT 0,
+            best_score_level4 INTEGER DEFAULT 0,
+            level1_plays INTEGER DEFAULT 0,
+            level2_plays INTEGER DEFAULT 0,
+            level3_plays INTEGER DEFAULT 0,
+            level4_plays INTEGER DEFAULT 0,
+            easy_games INTEGER DEFAULT 0,
+            hard_games INTEGER DEFAULT 0,
+            easy_correct INTEGER DEFAULT 0,
+            hard_correct INTEGER DEFAULT 0,
+            easy_total INTEGER DEFAULT 0,
+            hard_total INTEGER DEFAULT 0,
+            total_time_played INTEGER DEFAULT 0,
+            average_score REAL DEFAULT 0.0,
+            best_streak INTEGER DEFAULT 0,
+            current_streak INTEGER DEFAULT 0,
+            first_play DATETIME,
+            last_play DATETIME,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # Tabel game_history untuk track record detail
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS game_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            level INTEGER,
+            mode TEXT,
+            score INTEGER,
+            total_questions INTEGER,
+            percentage REAL,
+            duration INTEGER,
+            grade TEXT,
+            questions_data TEXT,
+            answers_data TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # Tabel user_progress untuk tracking pembelajaran
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            hiragana_char TEXT,
+            romaji TEXT,
+            correct_count INTEGER DEFAULT 0,
+            wrong_count INTEGER DEFAULT 0,
+            last_seen DATETIME,
+            mastery_level INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+def _migration_unique_user_stats(cursor: sqlite3.Cursor):
+    """Unique key user_stats.user_id (hapus row duplikat lebih dulu)"""
+    cursor.execute('''
+        DELETE FROM user_stats WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id ORDER BY total_games DESC, id
+                ) AS rn
+                FROM user_stats
+            ) WHERE rn = 1
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_user_stats_user_id ON user_stats (user_id)')
+
+def _migration_game_history_user_index(cursor: sqlite3.Cursor):
+    """Index untuk history per user yang diurutkan berdasarkan waktu"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_history_user_ts ON game_history (user_id, timestamp)')
+
+def _migration_users_last_active_index(cursor: sqlite3.Cursor):
+    """Index untuk daftar user berdasarkan aktivitas terakhir"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)')
+
+def _migration_epoch_timestamps(cursor: sqlite3.Cursor):
+    """Kolom epoch (sargable) untuk query rentang tanggal"""
+    cursor.execute('ALTER TABLE user_stats ADD COLUMN last_play_ts INTEGER')
+    cursor.execute("UPDATE user_stats SET last_play_ts = CAST(strftime('%s', last_play) AS INTEGER)")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_last_play_ts ON user_stats (last_play_ts)')
+    
+    cursor.execute('ALTER TABLE game_history ADD COLUMN played_at INTEGER')
+    cursor.execute("UPDATE game_history SET played_at = CAST(strftime('%s', timestamp) AS INTEGER)")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_history_played_at ON game_history (played_at)')
+
+# Counter global untuk admin dashboard (satu row, di-update incremental)
+GLOBAL_COUNTER_FIELDS = (
+    ['total_users', 'total_games', 'total_questions', 'total_correct', 'total_time_played',
+     'easy_games', 'hard_games']
+    + [f'level{level}_plays' for level in LEVELS]
+    + [f'level{level}_players' for level in LEVELS]
+    + [f'level{level}_best_sum' for level in LEVELS]
+)
+
+def recompute_global_counters(cursor: sqlite3.Cursor) -> Dict[str, int]:
+    """Hitung ulang global_counters dari nol (untuk repair drift)"""
+    level_columns = []
+    for level in LEVELS:
+        level_columns.append(f'COALESCE(SUM(level{level}_plays), 0)')
+    for level in LEVELS:
+        level_columns.append(f'COALESCE(SUM(level{level}_plays > 0), 0)')
+    for level in LEVELS:
+        level_columns.append(f'COALESCE(SUM(CASE WHEN level{level}_plays > 0 THEN best_score_level{level} ELSE 0 END), 0)')
+    
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO global_counters (id, {', '.join(GLOBAL_COUNTER_FIELDS)}, updated_at)
+        SELECT 1, (SELECT COUNT(*) FROM users),
+               COALESCE(SUM(total_games), 0), COALESCE(SUM(total_questions), 0),
+               COALESCE(SUM(total_correct), 0), COALESCE(SUM(total_time_played), 0),
+               COALESCE(SUM(easy_games), 0), COALESCE(SUM(hard_games), 0),
+               {', '.join(level_columns)}, CURRENT_TIMESTAMP
+        FROM user_stats
+    ''')
+    return load_global_counters(cursor)
+
+def load_global_counters(cursor: sqlite3.Cursor) -> Dict[str, int]:
+    """Baca row global_counters"""
+    cursor.execute(f"SELECT {', '.join(GLOBAL_COUNTER_FIELDS)} FROM global_counters WHERE id = 1")
+    row = cursor.fetchone()
+    return dict(zip(GLOBAL_COUNTER_FIELDS, row)) if row else dict.fromkeys(GLOBAL_COUNTER_FIELDS, 0)
+
+def apply_global_counter_deltas(cursor: sqlite3.Cursor, deltas: Dict[str, int]):
+    """Tambahkan delta ke global_counters (dalam transaksi pemanggil)"""
+    fields = [field for field, delta in deltas.items() if delta]
+    if not fields:
+        return
+    assignments = ', '.join(f'{field} = {field} + ?' for field in fields)
+    cursor.execute(
+        f'UPDATE global_counters SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = 1',
+        [deltas[field] for field in fields]
+    )
+
+def _migration_global_counters(cursor: sqlite3.Cursor):
+    """Tabel global_counters untuk admin dashboard"""
+    columns = ',\n'.join(f'            {field} INTEGER DEFAULT 0' for field in GLOBAL_COUNTER_FIELDS)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS global_counters (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+{columns},
+            updated_at DATETIME
+        )
+    ''')
+    recompute_global_counters(cursor)
+
+def _migration_broadcast_jobs(cursor: sqlite3.Cursor):
+    """Tabel job broadcast dengan state per recipient"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER,
+            user_id INTEGER,
+            state TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_state ON broadcast_recipients (job_id, state, user_id)')
+
+def _migration_image_file_ids(cursor: sqlite3.Cursor):
+    """Cache file_id Telegram untuk gambar romaji"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_file_ids (
+            romaji TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_quiz_session_state(cursor: sqlite3.Cursor):
+    """Checkpoint session quiz supaya selamat dari restart"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_session_state (
+            user_id INTEGER PRIMARY KEY,
+            chat_id INTEGER,
+            user_info TEXT,
+            level INTEGER,
+            mode TEXT,
+            questions TEXT,
+            current_question INTEGER DEFAULT 0,
+            score INTEGER DEFAULT 0,
+            start_time REAL,
+            time_limit INTEGER,
+            answers TEXT DEFAULT '',
+            paused_at REAL
+        )
+    ''')
+
+def _migration_compact_game_history(cursor: sqlite3.Cursor):
+    """Tulis ulang questions_data/answers_data JSON lama ke encoding biner"""
+    last_id = 0
+    while True:
+        rows = cursor.execute('''
+            SELECT id, questions_data, answers_data, played_at, duration FROM game_history
+            WHERE id > ? AND typeof(questions_data) = 'text'
+            ORDER BY id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, questions_data, answers_data, played_at, duration in rows:
+            last_id = row_id
+            try:
+                questions = json.loads(questions_data or '[]')
+                answers = json.loads(answers_data or '[]')
+                if played_at:
+                    start_time = played_at - (duration or 0)
+                else:
+                    start_time = min((answer['timestamp'] for answer in answers), default=0)
+                updates.append((GAME_RECORD_CODEC.encode_questions(questions),
+                                GAME_RECORD_CODEC.encode_answers(questions, answers, start_time), row_id))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Keeping legacy JSON for game_history row {row_id}: {e}")
+        cursor.executemany('UPDATE game_history SET questions_data = ?, answers_data = ? WHERE id = ?', updates)
+
+def _migration_deck_seeds(cursor: sqlite3.Cursor):
+    """Seed deck: checkpoint dan game_history cukup simpan seed + versi generator"""
+    for table in ('quiz_session_state', 'game_history'):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN deck_seed INTEGER')
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN deck_version INTEGER')
+
+def _migration_users_activity_cursor_index(cursor: sqlite3.Cursor):
+    """Covering index untuk paging /userlist dengan cursor (last_active, user_id)"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_activity_cursor
+        ON users (last_active, user_id, username, first_name, last_name, total_messages)
+    ''')
+    # Index lama (last_active) sudah tercakup prefix index baru
+    cursor.execute('DROP INDEX IF EXISTS idx_users_last_active')
+
+# Migrasi schema berurutan: (versi, deskripsi, fungsi)
+SCHEMA_MIGRATIONS = [
+    (1, "base tables", _migration_base_tables),
+    (2, "unique user_stats.user_id", _migration_unique_user_stats),
+    (3, "game_history (user_id, timestamp) index", _migration_game_history_user_index),
+    (4, "users last_active index", _migration_users_last_active_index),
+    (5, "epoch timestamp columns", _migration_epoch_timestamps),
+    (6, "global counters", _migration_global_counters),
+    (7, "broadcast jobs", _migration_broadcast_jobs),
+    (8, "image file_id cache", _migration_image_file_ids),
+    (9, "quiz session checkpoints", _migration_quiz_session_state),
+    (10, "compact game_history encoding", _migration_compact_game_history),
+    (11, "deck seeds", _migration_deck_seeds),
+    (12, "users activity cursor index", _migration_users_activity_cursor_index),
+]
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Jalankan migrasi yang belum diterapkan, return versi schema terbaru"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    
+    for version, description, migrate in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        # Setiap migrasi dalam satu transaksi (termasuk DDL)
+        conn.execute('BEGIN')
+        try:
+            migrate(conn.cursor())
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                         (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied schema migration {version}: {description}")
+        current = version
+    
+    return current
+
+class GlobalCounters:
+    """Mirror in-memory dari tabel global_counters"""
+    
+    def __init__(self):
+        self.values: Dict[str, int] = dict.fromkeys(GLOBAL_COUNTER_FIELDS, 0)
+        self.loaded_at: Optional[datetime] = None
+    
+    def load(self, values: Dict[str, int]):
+        """Ganti seluruh nilai (setelah startup atau recompute)"""
+        self.values = dict(values)
+        self.loaded_at = datetime.now()
+    
+    def apply(self, deltas: Dict[str, int]):
+        """Terapkan delta yang sudah di-commit ke database"""
+        for field, delta in deltas.items():
+            self.values[field] = self.values.get(field, 0) + delta
+    
+    def update(self, values: Dict[str, int]):
+        """Set nilai absolut yang dikembalikan RETURNING"""
+        self.values.update(values)
+    
+    def __getitem__(self, field: str) -> int:
+        return self.values.get(field, 0)
+
+class ImageAssetCache:
+    """Path gambar romaji (di-resolve sekali) dan cache file_id Telegram"""
+    
+    def __init__(self, directory: str = "."):
+        self.paths: Dict[str, str] = {}
+        for romaji in HIRAGANA_DATA.values():
+            path = os.path.join(directory, f"{romaji}.jpg")
+            if os.path.exists(path):
+                self.paths[romaji] = path
+        self.file_ids: Dict[str, str] = {}
+    
+    def load(self, file_ids: Dict[str, str]):
+        """Isi cache file_id dari database"""
+        self.file_ids = dict(file_ids)
+    
+    def path_for(self, romaji: str) -> Optional[str]:
+        return self.paths.get(romaji)
+    
+    def file_id_for(self, romaji: str) -> Optional[str]:
+        return self.file_ids.get(romaji)
+    
+    def remember(self, romaji: str, file_id: str) -> bool:
+        """Simpan file_id baru, return True kalau berubah"""
+        if self.file_ids.get(romaji) == file_id:
+            return False
+        self.file_ids[romaji] = file_id
+        return True
+    
+    def forget(self, romaji: str):
+        """Buang file_id yang sudah tidak valid"""
+        self.file_ids.pop(romaji, None)
+
+class SQLiteConnectionPool:
+    """Pool koneksi SQLite long-lived dengan PRAGMA yang sudah di-tuning"""
+    
+    def __init__(self, db_name: str = DB_NAME, size: int = DB_POOL_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Buka koneksi baru dan terapkan PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        """Ambil koneksi idle, buat baru kalau pool belum penuh"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        return self._idle.get(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    
+    def _release(self, conn: sqlite3.Connection):
+        """Kembalikan koneksi ke pool dalam keadaan bersih"""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Pinjam koneksi, dijamin dikembalikan walau terjadi error"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+    
+    def close_all(self):
+        """Tutup semua koneksi di pool"""
+        self._closed = True
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._all.clear()
+
+class ActivityTracker:
+    """Buffer aktivitas user: increment digabung per user sebelum ditulis ke DB"""
+    
+    def __init__(self, flush_events: int = ACTIVITY_FLUSH_EVENTS, max_profiles: int = ACTIVITY_PROFILE_CACHE_SIZE):
+        self.flush_events = flush_events
+        self.max_profiles = max_profiles
+        self._pending: Dict[int, Dict] = {}
+        self._known_profiles: OrderedDict = OrderedDict()
+        self._events = 0
+    
+    def record(self, user_id: int, profile: Tuple) -> bool:
+        """Catat satu pesan, return True kalau buffer sudah perlu di-flush"""
+        entry = self._pending.get(user_id)
+        if entry is None:
+            entry = self._pending[user_id] = {'messages': 0, 'last_active': None, 'profile': None}
+        entry['messages'] += 1
+        entry['last_active'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        
+        # Profil hanya ditulis kalau berubah
+        if self._known_profiles.get(user_id) != profile:
+            self._known_profiles[user_id] = profile
+            entry['profile'] = profile
+            if len(self._known_profiles) > self.max_profiles:
+                self._known_profiles.popitem(last=False)
+        self._known_profiles.move_to_end(user_id)
+        
+        self._events += 1
+        return self._events >= self.flush_events
+    
+    def drain(self) -> Dict[int, Dict]:
+        """Ambil semua aktivitas yang tertunda dan kosongkan buffer"""
+        batch = self._pending
+        self._pending = {}
+        self._events = 0
+        return batch
+    
+    def restore(self, batch: Dict[int, Dict]):
+        """Kembalikan batch yang gagal ditulis ke buffer"""
+        for user_id, old in batch.items():
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = old
+                self._events += old['messages']
+                continue
+            entry['messages'] += old['messages']
+            if entry['profile'] is None:
+                entry['profile'] = old['profile']
+            self._events += old['messages']
+    
+    def pending_users(self) -> int:
+        """Jumlah user yang aktivitasnya belum di-flush"""
+        return len(self._pending)
+
+class TrackRecordDigest:
+    """Buffer game selesai untuk digest owner (dikirim per N game atau per interval)"""
+    
+    def __init__(self, flush_games: int = TRACK_RECORD_DIGEST_GAMES, max_pending: int = TRACK_RECORD_MAX_PENDING):
+        self.flush_games = flush_games
+        self.max_pending = max_pending
+        self._pending: List[Dict] = []
+        self.dropped = 0
+    
+    def add(self, entry: Dict) -> bool:
+        """Catat satu game, return True kalau digest sudah perlu dikirim"""
+        self._pending.append(entry)
+        self._trim()
+        return len(self._pending) >= self.flush_games
+    
+    def drain(self) -> List[Dict]:
+        """Ambil semua game yang tertunda dan kosongkan buffer"""
+        batch = self._pending
+        self._pending = []
+        return batch
+    
+    def restore(self, batch: List[Dict]):
+        """Kembalikan batch yang gagal dikirim (tetap urut waktu)"""
+        self._pending = batch + self._pending
+        self._trim()
+    
+    def _trim(self):
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+    
+    @staticmethod
+    def build_entry(user_info: Dict, quiz_result: Dict) -> Dict:
+        """Ringkas hasil quiz jadi satu baris digest"""
+        level = quiz_result['level']
+        stats = quiz_result['user_stats']
+        return {
+            'ts': int(time.time()),
+            'user_id': user_info['id'],
+            'username': user_info['username'],
+            'name': user_info['full_name'],
+            'lang': user_info.get('language_code', ''),
+            'level': level,
+            'mode': quiz_result['mode'],
+            'score': quiz_result['score'],
+            'total': quiz_result['total'],
+            'pct': round(quiz_result['percentage'], 1),
+            'grade': quiz_result['grade'],
+            'secs': quiz_result['duration_seconds'],
+            'answers': ''.join('1' if answer['is_correct'] else '0' for answer in quiz_result['answers']),
+            'seed': quiz_result.get('deck_seed'),
+            'games': stats['total_games'],
+            'best': stats['best_scores'][level],
+            'plays': stats['level_plays'][level],
+            'streak': stats['current_streak'],
+            'best_streak': stats['best_streak'],
+        }
+    
+    @staticmethod
+    def render(batch: List[Dict]) -> Tuple[str, bytes]:
+        """Caption ringkasan + file JSONL detail"""
+        players = {entry['user_id'] for entry in batch}
+        avg_pct = sum(entry['pct'] for entry in batch) / len(batch)
+        easy = sum(1 for entry in batch if entry['mode'] == 'easy')
+        first = datetime.fromtimestamp(batch[0]['ts']).strftime('%H:%M')
+        last = datetime.fromtimestamp(batch[-1]['ts']).strftime('%H:%M')
+        
+        lines = [
+            "🎯 💎 TRACK RECORD DIGEST 💎",
+            f"🕒 {first} - {last} • {len(batch)} games • {len(players)} players",
+            f"📊 Avg {avg_pct:.1f}% • Easy {easy} • Hard {len(batch) - easy}",
+            "",
+        ]
+        for entry in batch[-TRACK_RECORD_SUMMARY_LINES:]:
+            who = f"@{entry['username']}" if entry['username'] else entry['name']
+            lines.append(f"• {who} Lv{entry['level']} {entry['mode']} {entry['score']}/{entry['total']} {entry['grade']}")
+        if len(batch) > TRACK_RECORD_SUMMARY_LINES:
+            lines.append(f"… +{len(batch) - TRACK_RECORD_SUMMARY_LINES} more in attachment")
+        
+        payload = ''.join(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n' for entry in batch)
+        return '\n'.join(lines)[:1024], payload.encode('utf-8')
+
+def _resolve_future(future: asyncio.Future, result=None, error: Optional[BaseException] = None):
+    """Set hasil future dari thread DB (abaikan kalau sudah dibatalkan)"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class DatabaseExecutor:
+    """Executor database: satu thread writer + pool thread untuk read"""
+    
+    def __init__(self, read_workers: int = DB_READ_WORKERS, queue_size: int = DB_QUEUE_SIZE):
+        self._write_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._write_slots = asyncio.Semaphore(queue_size)
+        self._read_slots = asyncio.Semaphore(queue_size)
+        self._read_pool = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-read")
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+    
+    def _writer_loop(self):
+        """Loop thread writer, menjalankan operasi tulis satu per satu"""
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            fn, args, kwargs, future, loop = item
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                loop.call_soon_threadsafe(_resolve_future, future, None, e)
+            else:
+                loop.call_soon_threadsafe(_resolve_future, future, result)
+    
+    async def write(self, fn, *args, **kwargs):
+        """Jalankan operasi tulis di thread writer (menunggu kalau antrian penuh)"""
+        async with self._write_slots:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._write_queue.put_nowait((fn, args, kwargs, future, loop))
+            return await future
+    
+    async def read(self, fn, *args, **kwargs):
+        """Jalankan operasi read di pool thread"""
+        async with self._read_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._read_pool, functools.partial(fn, *args, **kwargs))
+    
+    def pending_writes(self) -> int:
+        """Jumlah operasi tulis yang masih antri"""
+        return self._write_queue.qsize()
+    
+    def shutdown(self):
+        """Selesaikan semua antrian lalu hentikan thread"""
+        self._write_queue.put(None)
+        self._writer.join()
+        self._read_pool.shutdown(wait=True)
+
+class TokenBucket:
+    """Token bucket async untuk membatasi laju pengiriman"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    async def acquire(self):
+        """Tunggu sampai ada token (dan tidak sedang di-pause)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+    
+    def try_acquire(self) -> float:
+        """Ambil token tanpa menunggu, return 0 kalau berhasil atau detik yang harus ditunggu"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+    
+    def idle_since(self) -> float:
+        """Waktu (monotonic) terakhir bucket dipakai"""
+        return self._updated
+    
+    def pause(self, seconds: float):
+        """Hentikan semua pengiriman sementara (misalnya setelah RetryAfter)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+class OutboundShedError(Exception):
+    """Pesan prioritas rendah ditolak karena antrian keluar penuh"""
+
+class OutboundItem:
+    """Satu panggilan Bot API yang menunggu giliran"""
+    __slots__ = ('priority', 'chat_id', 'call', 'future', 'queued_at', 'retries')
+    
+    def __init__(self, priority: int, chat_id: Optional[int], call: Callable[[], Awaitable], future: asyncio.Future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.retries = 0
+
+class OutboundScheduler:
+    """Antrian pesan keluar terpusat: kelas prioritas, token bucket global + per chat, load shedding"""
+    
+    INTERACTIVE = 0  # Soal quiz dan feedback jawaban
+    RESULT = 1  # Hasil akhir quiz
+    OWNER = 2  # Notifikasi ke owner
+    BROADCAST = 3
+    CLASS_NAMES = ('interactive', 'result', 'owner', 'broadcast')
+    
+    def __init__(self, bot_getter: Callable[[], Any], workers: int = OUTBOUND_WORKERS,
+                 global_rate: float = OUTBOUND_GLOBAL_RATE, chat_rate: float = OUTBOUND_CHAT_RATE,
+                 chat_burst: float = OUTBOUND_CHAT_BURST, shed_depth: int = OUTBOUND_SHED_DEPTH):
+        self.bot_getter = bot_getter
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.shed_depth = shed_depth
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = 0
+        self._proxies: Dict[int, 'ScheduledBot'] = {}
+        classes = len(self.CLASS_NAMES)
+        self.depth = [0] * classes
+        self.submitted = [0] * classes
+        self.sent = [0] * classes
+        self.failed = [0] * classes
+        self.shed = [0] * classes
+        self.total_wait = [0.0] * classes
+        self.max_wait = [0.0] * classes
+    
+    def bot(self, priority: int) -> 'ScheduledBot':
+        """Proxy bot yang mengirim lewat antrian dengan prioritas tertentu"""
+        proxy = self._proxies.get(priority)
+        if proxy is None:
+            proxy = self._proxies[priority] = ScheduledBot(self, priority)
+        return proxy
+    
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        """Hentikan worker, panggilan yang masih antri digagalkan"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            _, _, item = self._queue.get_nowait()
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("Outbound scheduler stopped"))
+        self.depth = [0] * len(self.CLASS_NAMES)
+    
+    async def submit(self, priority: int, chat_id: Optional[int], call: Callable[[], Awaitable]) -> Any:
+        """Antrikan satu panggilan dan tunggu hasilnya"""
+        self.start()
+        if priority == self.BROADCAST and sum(self.depth) >= self.shed_depth:
+            self.shed[priority] += 1
+            raise OutboundShedError(f"Outbound queue depth {sum(self.depth)} >= {self.shed_depth}")
+        
+        item = OutboundItem(priority, chat_id, call, asyncio.get_running_loop().create_future())
+        self.submitted[priority] += 1
+        self.depth[priority] += 1
+        self._enqueue(item)
+        return await item.future
+    
+    def _enqueue(self, item: OutboundItem):
+        self._seq += 1
+        self._queue.put_nowait((item.priority, self._seq, item))
+    
+    def _requeue_later(self, item: OutboundItem, delay: float):
+        asyncio.get_running_loop().call_later(delay, self._enqueue, item)
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= 10000:
+                self._prune_chat_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+    
+    def _prune_chat_buckets(self):
+        """Buang bucket chat yang sudah penuh lagi (idle cukup lama)"""
+        cutoff = time.monotonic() - self.chat_burst / self.chat_rate
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.idle_since() < cutoff]:
+            del self._chat_buckets[chat_id]
+    
+    async def _worker(self):
+        while True:
+            _, _, item = await self._queue.get()
+            if item.future.done():
+                # Pemanggil sudah batal menunggu
+                self.depth[item.priority] -= 1
+                continue
+            
+            if item.chat_id is not None:
+                delay = self._chat_bucket(item.chat_id).try_acquire()
+                if delay > 0:
+                    self._requeue_later(item, delay)
+                    continue
+            await self.global_bucket.acquire()
+            
+            priority = item.priority
+            self.depth[priority] -= 1
+            wait = time.monotonic() - item.queued_at
+            self.total_wait[priority] += wait
+            self.max_wait[priority] = max(self.max_wait[priority], wait)
+            try:
+                result = await item.call()
+            except RetryAfter as e:
+                # Flood control satu chat tidak boleh membekukan chat lain
+                if item.chat_id is not None:
+                    self._chat_bucket(item.chat_id).pause(e.retry_after)
+                else:
+                    self.global_bucket.pause(e.retry_after)
+                if priority != self.BROADCAST and item.retries < OUTBOUND_MAX_RETRIES:
+                    item.retries += 1
+                    self.depth[priority] += 1
+                    self._requeue_later(item, e.retry_after)
+                    continue
+                self.failed[priority] += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
+            except Exception as e:
+                self.failed[priority] += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
+            else:
+                self.sent[priority] += 1
+                if not item.future.done():
+                    item.future.set_result(result)
+    
+    def stats(self) -> List[Dict[str, float]]:
+        """Kedalaman antrian dan waktu tunggu per kelas prioritas"""
+        return [{
+            'name': name,
+            'depth': self.depth[i],
+            'submitted': self.submitted[i],
+            'sent': self.sent[i],
+            'failed': self.failed[i],
+            'shed': self.shed[i],
+            'avg_wait_ms': self.total_wait[i] / (self.sent[i] + self.failed[i]) * 1000 if self.sent[i] + self.failed[i] else 0.0,
+            'max_wait_ms': self.max_wait[i] * 1000
+        } for i, name in enumerate(self.CLASS_NAMES)]
+
+class ScheduledBot:
+    """Proxy bot: setiap method dipanggil lewat OutboundScheduler dengan prioritas tetap"""
+    
+    def __init__(self, scheduler: OutboundScheduler, priority: int):
+        self._scheduler = scheduler
+        self._priority = priority
+    
+    def __getattr__(self, name: str):
+        async def call(*args, **kwargs):
+            method = getattr(self._scheduler.bot_getter(), name)
+            args, kwargs = self._freeze_files(method, args, kwargs)
+            return await self._scheduler.submit(self._priority, kwargs.get('chat_id'),
+                                                functools.partial(method, *args, **kwargs))
+        return call
+    
+    @staticmethod
+    def _freeze_files(method, args: Tuple, kwargs: Dict) -> Tuple[Tuple, Dict]:
+        """Baca stream file jadi bytes sekali: PTB membaca stream setiap request dibuat, jadi retry
+        setelah RetryAfter dengan stream yang sama akan mengirim file kosong"""
+        args = tuple(arg.read() if hasattr(arg, 'read') else arg for arg in args)
+        frozen = {}
+        for key, value in kwargs.items():
+            if hasattr(value, 'read'):
+                # Nama file dari stream (mis. open(path)) ikut hilang kalau tidak dipindah ke argumen filename
+                name = getattr(value, 'name', None)
+                if (isinstance(name, str) and 'filename' not in kwargs
+                        and 'filename' in inspect.signature(method).parameters):
+                    frozen['filename'] = os.path.basename(name)
+                value = value.read()
+            frozen[key] = value
+        return args, frozen
+
+class BroadcastEngine:
+    """Broadcast di background: job tersimpan di DB, worker pool, resumable"""
+    
+    def __init__(self, bot: 'PremiumHiraganaQuizBot', rate: float = BROADCAST_RATE, workers: int = BROADCAST_WORKERS):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.running: Dict[int, asyncio.Task] = {}
+    
+    # Database (dijalankan di thread executor)
+    def _create_job(self, message: str, status_chat_id: int, status_message_id: int) -> Tuple[int, int]:
+        """Simpan job baru beserta semua recipient aktif"""
+        with self.bot.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO broadcast_jobs (message, status_chat_id, status_message_id)
+                VALUES (?, ?, ?)
+            ''', (message, status_chat_id, status_message_id))
+            job_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO broadcast_recipients (job_id, user_id)
+                SELECT ?, user_id FROM users WHERE status = 'active'
+            ''', (job_id,))
+            total = cursor.rowcount
+            cursor.execute('''
+                UPDATE broadcast_jobs SET total = ?,
+                status = CASE WHEN ? = 0 THEN 'done' ELSE status END
+                WHERE id = ?
+            ''', (total, total, job_id))
+            conn.commit()
+            return job_id, total
+    
+    def _load_job(self, job_id: int) -> Optional[Dict]:
+        """Baca data job"""
+        with self.bot.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT message, status, total, sent, failed, status_chat_id, status_message_id
+                FROM broadcast_jobs WHERE id = ?
+            ''', (job_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        keys = ('message', 'status', 'total', 'sent', 'failed', 'status_chat_id', 'status_message_id')
+        return dict(zip(keys, row))
+    
+    def _fetch_pending(self, job_id: int, after_user_id: int) -> List[Tuple[int, int]]:
+        """Ambil batch recipient pending berikutnya (keyset pada user_id)"""
+        with self.bot.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, attempts FROM broadcast_recipients
+                WHERE job_id = ? AND state = 'pending' AND user_id > ?
+                ORDER BY user_id LIMIT ?
+            ''', (job_id, after_user_id, BROADCAST_BATCH_SIZE))
+            return cursor.fetchall()
+    
+    def _save_results(self, job_id: int, results: List[Tuple[int, str, int, Optional[str]]]):
+        """Simpan state recipient dan counter job dalam satu transaksi"""
+        sent = sum(1 for _, state, _, _ in results if state == 'sent')
+        failed = sum(1 for _, state, _, _ in results if state == 'failed')
+        with self.bot.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE broadcast_recipients SET state = ?, attempts = ?, last_error = ?
+                WHERE job_id = ? AND user_id = ?
+            ''', [(state, attempts, error, job_id, user_id) for user_id, state, attempts, error in results])
+            cursor.execute('''
+                UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ? WHERE id = ?
+            ''', (sent, failed, job_id))
+            conn.commit()
+    
+    def _finish_job(self, job_id: int):
+        """Tandai job selesai"""
+        with self.bot.get_db_connection() as conn:
+            conn.execute('''
+                UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', (job_id,))
+            conn.commit()
+    
+    def _unfinished_jobs(self) -> List[int]:
+        """Job yang masih berjalan saat bot terakhir berhenti"""
+        with self.bot.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+            return [row[0] for row in cursor.fetchall()]
+    
+    # Kontrol job
+    async def submit(self, message: str, status_chat_id: int, status_message_id: int) -> Tuple[int, int]:
+        """Buat job broadcast baru dan langsung jalankan di background"""
+        job_id, total = await self.bot.db.write(self._create_job, message, status_chat_id, status_message_id)
+        if total > 0:
+            self.start(job_id)
+        return job_id, total
+    
+    def start(self, job_id: int):
+        """Jalankan job di background (sekali per job)"""
+        if job_id in self.running:
+            return
+        task = self.bot.application.create_task(self.run_job(job_id))
+        self.running[job_id] = task
+        task.add_done_callback(lambda t: self.running.pop(job_id, None))
+    
+    async def resume(self):
+        """Lanjutkan job yang terputus karena crash/restart"""
+        for job_id in await self.bot.db.read(self._unfinished_jobs):
+            logger.info(f"Resuming broadcast job {job_id}")
+            self.start(job_id)
+    
+    async def stop(self):
+        """Hentikan semua job (progress tetap tersimpan untuk di-resume)"""
+        for task in list(self.running.values()):
+            task.cancel()
+        await asyncio.gather(*self.running.values(), return_exceptions=True)
+    
+    async def run_job(self, job_id: int):
+        """Proses satu job sampai semua recipient selesai"""
+        job = await self.bot.db.read(self._load_job, job_id)
+        if not job or job['status'] != 'running':
+            return
+        
+        recipients: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_BATCH_SIZE)
+        results: List[Tuple[int, str, int, Optional[str]]] = []
+        progress = {'sent': job['sent'], 'failed': job['failed'], 'last_edit': time.monotonic()}
+        
+        async def flush_results():
+            if results:
+                batch = results[:]
+                results.clear()
+                await self.bot.db.write(self._save_results, job_id, batch)
+        
+        async def worker():
+            while True:
+                item = await recipients.get()
+                if item is None:
+                    return
+                user_id, attempts = item
+                state, attempts, error = await self.deliver(user_id, job['message'], attempts)
+                results.append((user_id, state, attempts, error))
+                progress[state] += 1
+                if len(results) >= BROADCAST_RESULT_FLUSH:
+                    await flush_results()
+                await self.report_progress(job, progress)
+        
+        workers = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            after_user_id = 0
+            while True:
+                batch = await self.bot.db.read(self._fetch_pending, job_id, after_user_id)
+                if not batch:
+                    break
+                for item in batch:
+                    await recipients.put(item)
+                after_user_id = batch[-1][0]
+            for _ in workers:
+                await recipients.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await flush_results()
+        
+        await self.bot.db.write(self._finish_job, job_id)
+        await self.report_done(job, progress)
+        logger.info(f"Broadcast job {job_id} finished: {progress['sent']} sent, {progress['failed']} failed")
+    
+    async def deliver(self, user_id: int, message: str, attempts: int) -> Tuple[str, int, Optional[str]]:
+        """Kirim ke satu recipient dengan retry, return (state, attempts, error)"""
+        while True:
+            await self.bucket.acquire()
+            attempts += 1
+            try:
+                await self.bot.outbound.bot(OutboundScheduler.BROADCAST).send_message(
+                    chat_id=user_id,
+                    text=message,
+                    parse_mode='Markdown'
+                )
+                return 'sent', attempts, None
+            except OutboundShedError:
+                # Antrian keluar penuh oleh traffic quiz: mundur dulu (tidak dihitung gagal)
+                attempts -= 1
+                await asyncio.sleep(OUTBOUND_SHED_BACKOFF)
+            except RetryAfter as e:
+                # Flood control: pause semua worker, lalu coba lagi (tidak dihitung gagal)
+                logger.warning(f"Broadcast flood control, pausing {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+                attempts -= 1
+            except (Forbidden, BadRequest) as e:
+                return 'failed', attempts, str(e)[:200]
+            except (NetworkError, TimedOut) as e:
+                if attempts >= BROADCAST_MAX_ATTEMPTS:
+                    return 'failed', attempts, str(e)[:200]
+                await asyncio.sleep(min(30, 2 ** attempts))
+            except Exception as e:
+                logger.warning(f"Failed to send broadcast to {user_id}: {e}")
+                return 'failed', attempts, str(e)[:200]
+    
+    async def report_progress(self, job: Dict, progress: Dict):
+        """Edit pesan status, dibatasi maksimal sekali per interval"""
+        now = time.monotonic()
+        if now - progress['last_edit'] < BROADCAST_PROGRESS_INTERVAL or not job['status_message_id']:
+            return
+        progress['last_edit'] = now
+        try:
+            await self.bot.outbound.bot(OutboundScheduler.OWNER).edit_message_text(
+                chat_id=job['status_chat_id'],
+                message_id=job['status_message_id'],
+                text=f"📡 Broadcasting... {progress['sent'] + progress['failed']}/{job['total']} processed "
+                     f"({progress['sent']} sent, {progress['failed']} failed)"
+            )
+        except Exception as e:
+            logger.info(f"Could not update broadcast progress: {e}")
+    
+    async def report_done(self, job: Dict, progress: Dict):
+        """Tampilkan ringkasan akhir di pesan status"""
+        total = job['total']
+        final_message = f"""
+✅ **Broadcast Complete!**
+
+📊 **Results:**
+• Total Users: {total}
+• Successfully Sent: {progress['sent']}
+• Failed: {progress['failed']}
+• Success Rate: {(progress['sent']/total*100) if total > 0 else 0:.1f}%
+            """
+        try:
+            await self.bot.outbound.bot(OutboundScheduler.OWNER).edit_message_text(
+                chat_id=job['status_chat_id'],
+                message_id=job['status_message_id'],
+                text=final_message,
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.warning(f"Could not send broadcast summary: {e}")
 
-# Reverse mapping untuk mencari hiragana dari romaji
-ROMAJI_TO_HIRAGANA = {v: k for k, v in HIRAGANA_DATA.items()}
+class TunedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest dengan keep-alive/HTTP2 yang bisa diatur dan metrik antrian per pool"""
+    
+    def __init__(self, name: str, pool_size: int, read_timeout: float = HTTP_READ_TIMEOUT,
+                 write_timeout: float = HTTP_WRITE_TIMEOUT, connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                 pool_timeout: float = HTTP_POOL_TIMEOUT, keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+                 http2: bool = HTTP2_ENABLED):
+        if http2 and importlib.util.find_spec('h2') is None:
+            logger.warning(f"HTTP/2 requested for {name} pool but the h2 package is missing, using HTTP/1.1")
+            http2 = False
+        # Dipakai _build_client, jadi client (dan pool koneksinya) cukup dibangun sekali oleh super().__init__
+        self._tuned_client_kwargs = {
+            'limits': httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive_expiry
+            ),
+            'http2': http2
+        }
+        super().__init__(connection_pool_size=pool_size, read_timeout=read_timeout, write_timeout=write_timeout,
+                         connect_timeout=connect_timeout, pool_timeout=pool_timeout)
+        
+        self.name = name
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        # Slot sendiri (seukuran pool) supaya waktu tunggu koneksi bisa diukur
+        self._slots = asyncio.Semaphore(pool_size)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.pool_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_latency = 0.0
+    
+    async def do_request(self, url: str, method: str, request_data: RequestData = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        queued = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.pool_timeout)
+        except asyncio.TimeoutError:
+            self.pool_timeouts += 1
+            raise TimedOut(f"Pool timeout: all {self.pool_size} connections of the {self.name} pool are busy")
+        
+        started = time.monotonic()
+        wait = started - queued
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.requests += 1
+        try:
+            return await super().do_request(url, method, request_data,
+                                            self._at_least(read_timeout, self.read_timeout),
+                                            self._at_least(write_timeout, self.write_timeout),
+                                            connect_timeout, pool_timeout)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.total_latency += time.monotonic() - started
+            self._slots.release()
+    
+    def stats(self) -> Dict[str, float]:
+        """Metrik pool: in-flight, waktu tunggu slot dan latency"""
+        return {
+            'name': self.name,
+            'pool_size': self.pool_size,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'pool_timeouts': self.pool_timeouts,
+            'avg_wait_ms': self.total_wait / self.requests * 1000 if self.requests else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+            'avg_latency_ms': self.total_latency / self.requests * 1000 if self.requests else 0.0
+        }
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        self._client_kwargs.update(self._tuned_client_kwargs)
+        return super()._build_client()
+    
+    @staticmethod
+    def _at_least(timeout, floor: float):
+        """Timeout per panggilan dari PTB (mis. write_timeout=20 di send_photo) tidak boleh di bawah timeout lane"""
+        if isinstance(timeout, (int, float)) and timeout < floor:
+            return floor
+        return timeout
 
-# Pembagian level yang lebih seimbang
-LEVELS = {
-    1: ['あ', 'い', 'う', 'え', 'お', 'か', 'き', 'く', 'け', 'こ', 'さ', 'し'],
-    2: ['す', 'せ', 'そ', 'た', 'ち', 'つ', 'て', 'と', 'な', 'に', 'ぬ', 'ね'],
-    3: ['の', 'は', 'ひ', 'ふ', 'へ', 'ほ', 'ま', 'み', 'む', 'め', 'も', 'や'],
-    4: ['ゆ', 'よ', 'ら', 'り', 'る', 'れ', 'ろ', 'わ', 'を', 'ん', 'が', 'ぎ']
-}
+class RoutedRequest(BaseRequest):
+    """Arahkan upload file ke lane media, sisanya ke lane default"""
+    
+    def __init__(self, default: TunedHTTPXRequest, media: TunedHTTPXRequest):
+        self.default = default
+        self.media = media
+    
+    async def initialize(self):
+        await self.default.initialize()
+        await self.media.initialize()
+    
+    async def shutdown(self):
+        await self.default.shutdown()
+        await self.media.shutdown()
+    
+    async def do_request(self, url: str, method: str, request_data: RequestData = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        lane = self.media if request_data is not None and request_data.contains_files else self.default
+        return await lane.do_request(url, method, request_data, read_timeout, write_timeout,
+                                     connect_timeout, pool_timeout)
+    
+    def lanes(self) -> List[TunedHTTPXRequest]:
+        return [self.default, self.media]
 
-# Storage untuk quiz session dan user data
-quiz_sessions: Dict[int, Dict] = {}
-user_statistics: Dict[int, Dict] = {}
-used_romaji: Dict[int, List[str]] = {}
+class WebhookServer:
+    """Server aiohttp yang menerima update Telegram dan meneruskannya ke update_queue"""
+    
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+    
+    def __init__(self, application: Application, path: str = WEBHOOK_PATH, secret_token: str = WEBHOOK_SECRET_TOKEN,
+                 max_body: int = WEBHOOK_MAX_BODY, health: Optional[Callable[[], Dict]] = None):
+        if not secret_token:
+            raise ValueError("Webhook secret token is required")
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self.health = health
+        self.received = 0
+        self.rejected = 0
+    
+    def build_app(self) -> web.Application:
+        """Bangun aiohttp app: route webhook + health"""
+        app = web.Application(client_max_size=self.max_body)
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get(HEALTH_PATH, self.handle_health)
+        return app
+    
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Verifikasi secret token dan ukuran body, lalu antrikan update"""
+        token = request.headers.get(self.SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.rejected += 1
+            return web.Response(status=403)
+        
+        if request.content_length is not None and request.content_length > self.max_body:
+            self.rejected += 1
+            return web.Response(status=413)
+        
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except web.HTTPRequestEntityTooLarge:
+            self.rejected += 1
+            return web.Response(status=413)
+        except Exception as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            self.rejected += 1
+            return web.Response(status=400)
+        
+        if update is None:
+            self.rejected += 1
+            return web.Response(status=400)
+        
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return web.Response()
+    
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Health check untuk load balancer"""
+        status = {'status': 'ok', 'received': self.received, 'rejected': self.rejected}
+        if self.health:
+            status.update(self.health())
+        return web.json_response(status)
 
 class PremiumHiraganaQuizBot:
     def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        self.http_request = RoutedRequest(
+            default=TunedHTTPXRequest("default", HTTP_POOL_SIZE),
+            media=TunedHTTPXRequest("media", HTTP_MEDIA_POOL_SIZE,
+                                    read_timeout=HTTP_MEDIA_READ_TIMEOUT, write_timeout=HTTP_MEDIA_WRITE_TIMEOUT)
+        )
+        self.get_updates_request = TunedHTTPXRequest("polling", HTTP_GET_UPDATES_POOL_SIZE,
+                                                 read_timeout=HTTP_GET_UPDATES_READ_TIMEOUT)
+        self.application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .request(self.http_request)
+            .get_updates_request(self.get_updates_request)
+            .concurrent_updates(MAX_CONCURRENT_UPDATES)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+        self.db_pool = SQLiteConnectionPool()
+        self.db = DatabaseExecutor()
+        self.update_serializer = UserUpdateSerializer()
+        self.pending_transitions: Dict[int, asyncio.Task] = {}
+        self.activity_tracker = ActivityTracker()
+        self.activity_flush_lock = asyncio.Lock()
+        self.track_digest = TrackRecordDigest()
+        self.track_digest_lock = asyncio.Lock()
+        self.background_tasks: List[asyncio.Task] = []
+        self.global_counters = GlobalCounters()
+        self.broadcast_engine = BroadcastEngine(self)
+        self.image_cache = ImageAssetCache()
+        self.sessions = SessionStore()
+        self.outbound = OutboundScheduler(lambda: self.application.bot)
+        self.stats_cache = UserStatsCache()
+        self.leaderboard = LeaderboardIndex()
+        self.export_lock = asyncio.Lock()
         self.setup_database()
         self.setup_handlers()
         self.setup_error_handling()
     
     def setup_database(self):
-        """Setup database SQLite untuk data yang lebih robust"""
+        """Setup database SQLite dan jalankan migrasi schema yang tertunda"""
         try:
-            conn = sqlite3.connect(DB_NAME)
-            cursor = conn.cursor()
-            
-            # Tabel users dengan informasi tambahan
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    is_bot INTEGER DEFAULT 0,
-                    language_code TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    last_active DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    total_messages INTEGER DEFAULT 0,
-                    status TEXT DEFAULT 'active'
-                )
-            ''')
-            
-            # Tabel user_stats dengan detail lengkap
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_stats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    total_games INTEGER DEFAULT 0,
-                    total_questions INTEGER DEFAULT 0,
-                    total_correct INTEGER DEFAULT 0,
-                    best_score_level1 INTEGER DEFAULT 0,
-                    best_score_level2 INTEGER DEFAULT 0,
-                    best_score_level3 INTEGER DEFAULT 0,
-                    best_score_level4 INTEGER DEFAULT 0,
-                    level1_plays INTEGER DEFAULT 0,
-                    level2_plays INTEGER DEFAULT 0,
-                    level3_plays INTEGER DEFAULT 0,
-                    level4_plays INTEGER DEFAULT 0,
-                    easy_games INTEGER DEFAULT 0,
-                    hard_games INTEGER DEFAULT 0,
-                    easy_correct INTEGER DEFAULT 0,
-                    hard_correct INTEGER DEFAULT 0,
-                    easy_total INTEGER DEFAULT 0,
-                    hard_total INTEGER DEFAULT 0,
-                    total_time_played INTEGER DEFAULT 0,
-                    average_score REAL DEFAULT 0.0,
-                    best_streak INTEGER DEFAULT 0,
-                    current_streak INTEGER DEFAULT 0,
-                    first_play DATETIME,
-                    last_play DATETIME,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # Tabel game_history untuk track record detail
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS game_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    level INTEGER,
-                    mode TEXT,
-                    score INTEGER,
-                    total_questions INTEGER,
-                    percentage REAL,
-                    duration INTEGER,
-                    grade TEXT,
-                    questions_data TEXT,
-                    answers_data TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # Tabel user_progress untuk tracking pembelajaran
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_progress (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    hiragana_char TEXT,
-                    romaji TEXT,
-                    correct_count INTEGER DEFAULT 0,
-                    wrong_count INTEGER DEFAULT 0,
-                    last_seen DATETIME,
-                    mastery_level INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info("Database setup completed successfully")
+            with self.get_db_connection() as conn:
+                version = run_migrations(conn)
+                self.global_counters.load(load_global_counters(conn.cursor()))
+                self.image_cache.load(dict(conn.execute('SELECT romaji, file_id FROM image_file_ids')))
+                ranked = self.load_leaderboard(conn)
+                logger.info(f"Leaderboard index built for {ranked} players")
+                restored = self.restore_sessions(conn)
+                if restored:
+                    logger.info(f"Restored {restored} in-flight quiz sessions")
+            logger.info(f"Database setup completed successfully (schema v{version})")
         except Exception as e:
             logger.error(f"Database setup error: {e}")
     
     def setup_handlers(self):
         """Setup semua handler untuk bot"""
         handlers = [
-            CommandHandler("start", self.start_command),
-            CommandHandler("stats", self.stats_command),
-            CommandHandler("help", self.help_command),
-            CommandHandler("adminstats", self.admin_stats_command),
-            CommandHandler("userlist", self.user_list_command),
-            CommandHandler("userinfo", self.user_info_command),
-            CommandHandler("broadcast", self.broadcast_command),
-            CommandHandler("gamehistory", self.game_history_command),
-            CallbackQueryHandler(self.button_callback),
-            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_broadcast_message)
+            CommandHandler("start", self.serialized(self.start_command)),
+            CommandHandler("stats", self.serialized(self.stats_command)),
+            CommandHandler("help", self.serialized(self.help_command)),
+            CommandHandler("leaderboard", self.serialized(self.leaderboard_command)),
+            CommandHandler("adminstats", self.serialized(self.admin_stats_command)),
+            CommandHandler("userlist", self.serialized(self.user_list_command)),
+            CommandHandler("userinfo", self.serialized(self.user_info_command)),
+            CommandHandler("broadcast", self.serialized(self.broadcast_command)),
+            CommandHandler("gamehistory", self.serialized(self.game_history_command)),
+            CommandHandler("recountstats", self.serialized(self.recount_stats_command)),
+            CommandHandler("export", self.serialized(self.export_command)),
+            CallbackQueryHandler(self.serialized(self.button_callback)),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, self.serialized(self.handle_broadcast_message))
         ]
         
         for handler in handlers:
             self.application.add_handler(handler)
     
+    def serialized(self, callback):
+        """Bungkus handler supaya update per user diproses berurutan"""
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            user = update.effective_user if isinstance(update, Update) else None
+            if user is None:
+                return await callback(update, context)
+            async with self.update_serializer.lock(user.id):
+                return await callback(update, context)
+        return wrapper
+    
+    async def post_init(self, application: Application):
+        """Jalankan background task setelah application siap"""
+        self.outbound.start()
+        self.background_tasks.append(application.create_task(self.activity_flush_loop()))
+        self.background_tasks.append(application.create_task(self.session_sweep_loop()))
+        self.background_tasks.append(application.create_task(self.track_record_loop()))
+        await self.broadcast_engine.resume()
+    
+    async def post_shutdown(self, application: Application):
+        """Flush dan tutup executor database saat bot berhenti"""
+        await self.broadcast_engine.stop()
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        self.background_tasks.clear()
+        
+        await self.flush_activity()
+        if len(self.track_digest):
+            # PTB menjalankan post_shutdown setelah request bot ditutup: buka lagi sebentar untuk digest terakhir
+            await self.http_request.initialize()
+            try:
+                await self.flush_track_records()
+            finally:
+                await self.http_request.shutdown()
+        await self.outbound.stop()
+        if len(self.sessions):
+            await self.db.write(self._pause_session_states, time.time())
+        await asyncio.get_running_loop().run_in_executor(None, self.db.shutdown)
+        self.db_pool.close_all()
+        logger.info("Database executor stopped")
+    
     def setup_error_handling(self):
         """Setup error handling premium"""
         self.application.add_error_handler(self.error_handler)
@@ -218,8 +2430,11 @@ class PremiumHiraganaQuizBot:
     
     async def safe_edit_message(self, query, text, reply_markup=None, parse_mode='Markdown'):
         """Edit message dengan safe handling"""
+        bot = self.outbound.bot(OutboundScheduler.INTERACTIVE)
         try:
-            await query.edit_message_text(
+            await bot.edit_message_text(
+                chat_id=query.message.chat_id,
+                message_id=query.message.message_id,
                 text=text,
                 reply_markup=reply_markup,
                 parse_mode=parse_mode
@@ -233,7 +2448,7 @@ class PremiumHiraganaQuizBot:
                 logger.warning("Message to edit not found")
                 # Send new message instead
                 try:
-                    await self.application.bot.send_message(
+                    await bot.send_message(
                         chat_id=query.message.chat_id,
                         text=text,
                         reply_markup=reply_markup,
@@ -251,81 +2466,112 @@ class PremiumHiraganaQuizBot:
             return False
     
     def get_db_connection(self):
-        """Dapatkan koneksi database"""
-        return sqlite3.connect(DB_NAME)
+        """Pinjam koneksi dari pool (dipakai dengan `with`, otomatis dikembalikan)"""
+        return self.db_pool.connection()
     
-    def init_user(self, user_id: int, username: str, first_name: str, last_name: str = "", language_code: str = ""):
-        """Inisialisasi user baru di database"""
-        try:
-            conn = self.get_db_connection()
+    async def init_user(self, user_id: int, username: str, first_name: str, last_name: str = "", language_code: str = ""):
+        """Catat aktivitas user ke buffer write-behind (di-flush secara batch)"""
+        profile = (username, first_name, last_name, language_code)
+        if self.activity_tracker.record(user_id, profile):
+            self.application.create_task(self.flush_activity())
+    
+    async def flush_activity(self):
+        """Flush buffer aktivitas ke database dalam satu transaksi"""
+        async with self.activity_flush_lock:
+            batch = self.activity_tracker.drain()
+            if not batch:
+                return
+            try:
+                new_users = await self.db.write(self._flush_activity, batch)
+                self.global_counters.apply({'total_users': new_users})
+            except Exception as e:
+                logger.error(f"Error flushing user activity: {e}")
+                self.activity_tracker.restore(batch)
+    
+    async def activity_flush_loop(self):
+        """Flush buffer aktivitas secara periodik"""
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+            await self.flush_activity()
+    
+    def _flush_activity(self, batch: Dict[int, Dict]) -> int:
+        """Tulis aktivitas user yang sudah digabung dengan batched UPSERT, return jumlah user baru"""
+        new_profiles = []
+        activity_only = []
+        for user_id, entry in batch.items():
+            if entry['profile'] is not None:
+                username, first_name, last_name, language_code = entry['profile']
+                new_profiles.append((user_id, username, first_name, last_name, language_code,
+                                     entry['last_active'], entry['messages']))
+            else:
+                activity_only.append((entry['last_active'], entry['messages'], user_id))
+        
+        with self.get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Update user info
-            cursor.execute('''
-                INSERT OR REPLACE INTO users 
+            # Cek user mana yang benar-benar baru untuk counter total_users
+            existing = set()
+            profile_ids = [row[0] for row in new_profiles]
+            for i in range(0, len(profile_ids), 500):
+                chunk = profile_ids[i:i + 500]
+                cursor.execute(
+                    f"SELECT user_id FROM users WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                existing.update(row[0] for row in cursor.fetchall())
+            new_users = len(profile_ids) - len(existing)
+            
+            # Profil baru/berubah: UPSERT tanpa menghapus row (created_at tetap)
+            cursor.executemany('''
+                INSERT INTO users 
                 (user_id, username, first_name, last_name, language_code, last_active, total_messages)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 
-                        COALESCE((SELECT total_messages FROM users WHERE user_id = ?), 0) + 1)
-            ''', (user_id, username, first_name, last_name, language_code, user_id))
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    language_code = excluded.language_code,
+                    last_active = excluded.last_active,
+                    total_messages = users.total_messages + excluded.total_messages
+            ''', new_profiles)
+            
+            # Profil sama: cukup update aktivitas
+            cursor.executemany('''
+                UPDATE users SET last_active = ?, total_messages = total_messages + ?
+                WHERE user_id = ?
+            ''', activity_only)
             
             # Initialize user stats if not exists
-            cursor.execute('SELECT user_id FROM user_stats WHERE user_id = ?', (user_id,))
-            if not cursor.fetchone():
-                cursor.execute('''
-                    INSERT INTO user_stats (user_id, first_play, last_play)
-                    VALUES (?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ''', (user_id,))
+            cursor.executemany('''
+                INSERT OR IGNORE INTO user_stats (user_id, first_play, last_play)
+                VALUES (?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ''', [(row[0],) for row in new_profiles])
             
+            apply_global_counter_deltas(cursor, {'total_users': new_users})
             conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Error initializing user: {e}")
-    
-    def get_user_stats(self, user_id: int) -> Dict:
-        """Dapatkan statistik user dari database"""
-        try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                return {
-                    'user_id': result[1],
-                    'total_games': result[2] or 0,
-                    'total_questions': result[3] or 0,
-                    'total_correct': result[4] or 0,
-                    'best_scores': {
-                        1: result[5] or 0, 2: result[6] or 0, 3: result[7] or 0, 4: result[8] or 0
-                    },
-                    'level_plays': {
-                        1: result[9] or 0, 2: result[10] or 0, 3: result[11] or 0, 4: result[12] or 0
-                    },
-                    'mode_stats': {
-                        'easy': {
-                            'games': result[13] or 0,
-                            'correct': result[15] or 0,
-                            'total': result[17] or 0
-                        },
-                        'hard': {
-                            'games': result[14] or 0,
-                            'correct': result[16] or 0,
-                            'total': result[18] or 0
-                        }
-                    },
-                    'total_time_played': result[19] or 0,
-                    'average_score': result[20] or 0.0,
-                    'best_streak': result[21] or 0,
-                    'current_streak': result[22] or 0,
-                    'first_play': result[23] or datetime.now().isoformat(),
-                    'last_play': result[24] or datetime.now().isoformat()
-                }
-        except Exception as e:
-            logger.error(f"Error getting user stats: {e}")
         
-        return self.create_default_stats()
+        return new_users
+    
+    async def get_user_stats(self, user_id: int) -> Dict:
+        """Dapatkan statistik user (cache dulu, baru database)"""
+        stats = self.stats_cache.get(user_id)
+        if stats is None:
+            token = self.stats_cache.write_token()
+            try:
+                stats = await self.db.read(self._load_user_stats, user_id)
+            except Exception as e:
+                logger.error(f"Error getting user stats: {e}")
+                return self.create_default_stats()
+            # User tanpa row tidak di-cache: row-nya bisa dibuat oleh flush aktivitas
+            if stats is None:
+                return self.create_default_stats()
+            self.stats_cache.fill(user_id, stats, token)
+        return stats.to_dict()
+    
+    def _load_user_stats(self, user_id: int) -> Optional[UserStats]:
+        """Baca statistik user dari database"""
+        with self.get_db_connection() as conn:
+            row = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+        return UserStats.from_row(row) if row else None
     
     def create_default_stats(self) -> Dict:
         """Buat statistik default"""
@@ -347,73 +2593,106 @@ class PremiumHiraganaQuizBot:
             'last_play': datetime.now().isoformat()
         }
     
-    def update_user_stats(self, user_id: int, quiz_result: Dict):
-        """Update statistik user setelah quiz selesai"""
+    async def update_user_stats(self, user_id: int, quiz_result: Dict) -> Optional[Dict]:
+        """Finalisasi game (non-blocking), return statistik baru user"""
+        result = await self.db.write(self._update_user_stats, user_id, quiz_result)
+        if result is None:
+            self.stats_cache.invalidate(user_id)
+            return None
+        counters, stats = result
+        self.stats_cache.put(user_id, stats)
+        self.leaderboard.update(stats, quiz_result.get('player_name'))
+        self.global_counters.update(counters)
+        return stats.to_dict()
+    
+    def _update_user_stats(self, user_id: int, quiz_result: Dict) -> Optional[Tuple[Dict[str, int], UserStats]]:
+        """Finalisasi game dalam satu transaksi dengan increment di sisi SQL, return counter global dan statistik baru"""
+        level = quiz_result['level']
+        mode = quiz_result['mode']
+        score = quiz_result['score']
+        total = quiz_result['total']
+        duration = quiz_result.get('duration_seconds', 0)
+        perfect = 1 if score == total else 0
+        questions = quiz_result.get('questions', [])
+        deck_seed = quiz_result.get('deck_seed')
+        counter_fields = ('total_games', 'total_questions', 'total_correct', 'total_time_played',
+                          f'{mode}_games', f'level{level}_plays', f'level{level}_players', f'level{level}_best_sum')
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            stats = self.get_user_stats(user_id)
-            
-            # Update basic stats
-            total_games = stats['total_games'] + 1
-            total_questions = stats['total_questions'] + quiz_result['total']
-            total_correct = stats['total_correct'] + quiz_result['score']
-            
-            # Calculate average score
-            new_average = total_correct / total_questions if total_questions > 0 else 0
-            
-            # Update level specific stats
-            level = quiz_result['level']
-            best_score = max(stats['best_scores'][level], quiz_result['score'])
-            level_plays = stats['level_plays'][level] + 1
-            
-            # Update mode specific stats
-            mode = quiz_result['mode']
-            mode_games = stats['mode_stats'][mode]['games'] + 1
-            mode_correct = stats['mode_stats'][mode]['correct'] + quiz_result['score']
-            mode_total = stats['mode_stats'][mode]['total'] + quiz_result['total']
-            
-            # Update time played
-            total_time = stats['total_time_played'] + quiz_result.get('duration_seconds', 0)
-            
-            # Update streak
-            if quiz_result['score'] == quiz_result['total']:
-                current_streak = stats['current_streak'] + 1
-                best_streak = max(stats['best_streak'], current_streak)
-            else:
-                current_streak = 0
-                best_streak = stats['best_streak']
-            
-            cursor.execute(f'''
-                UPDATE user_stats SET 
-                total_games = ?, total_questions = ?, total_correct = ?,
-                best_score_level{level} = ?, level{level}_plays = ?,
-                {mode}_games = ?, {mode}_correct = ?, {mode}_total = ?,
-                total_time_played = ?, average_score = ?, best_streak = ?, current_streak = ?,
-                last_play = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (total_games, total_questions, total_correct, best_score, level_plays,
-                 mode_games, mode_correct, mode_total, total_time, new_average, 
-                 best_streak, current_streak, user_id))
-            
-            # Save detailed game history
-            cursor.execute('''
-                INSERT INTO game_history 
-                (user_id, level, mode, score, total_questions, percentage, duration, grade, 
-                 questions_data, answers_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, level, mode, quiz_result['score'], quiz_result['total'],
-                  quiz_result['percentage'], quiz_result.get('duration_seconds', 0),
-                  quiz_result['grade'], 
-                  json.dumps(quiz_result.get('questions', [])),
-                  json.dumps(quiz_result.get('answers', []))))
-            
-            conn.commit()
-            conn.close()
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                
+                # Row stats bisa belum ada kalau aktivitas user belum di-flush
+                cursor.execute('''
+                    INSERT OR IGNORE INTO user_stats (user_id, first_play, last_play)
+                    VALUES (?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ''', (user_id,))
+                
+                # Counter global lebih dulu: subquery masih melihat statistik sebelum game ini
+                cursor.execute(f'''
+                    UPDATE global_counters SET
+                    total_games = total_games + 1,
+                    total_questions = total_questions + ?,
+                    total_correct = total_correct + ?,
+                    total_time_played = total_time_played + ?,
+                    {mode}_games = {mode}_games + 1,
+                    level{level}_plays = level{level}_plays + 1,
+                    level{level}_players = level{level}_players +
+                        (SELECT level{level}_plays = 0 FROM user_stats WHERE user_id = ?),
+                    level{level}_best_sum = level{level}_best_sum +
+                        (SELECT MAX(? - best_score_level{level}, 0) FROM user_stats WHERE user_id = ?),
+                    updated_at = CURRENT_TIMESTAMP
+                    WHERE id = 1
+                    RETURNING {', '.join(counter_fields)}
+                ''', (total, score, duration, user_id, score, user_id))
+                counters = dict(zip(counter_fields, cursor.fetchone()))
+                
+                # Semua nilai di sisi kanan memakai nilai lama row (semantik UPDATE SQLite)
+                cursor.execute(f'''
+                    UPDATE user_stats SET 
+                    total_games = total_games + 1,
+                    total_questions = total_questions + ?,
+                    total_correct = total_correct + ?,
+                    best_score_level{level} = MAX(best_score_level{level}, ?),
+                    level{level}_plays = level{level}_plays + 1,
+                    {mode}_games = {mode}_games + 1,
+                    {mode}_correct = {mode}_correct + ?,
+                    {mode}_total = {mode}_total + ?,
+                    total_time_played = total_time_played + ?,
+                    average_score = CASE WHEN total_questions + ? > 0
+                        THEN CAST(total_correct + ? AS REAL) / (total_questions + ?) ELSE 0 END,
+                    current_streak = CASE WHEN ? THEN current_streak + 1 ELSE 0 END,
+                    best_streak = CASE WHEN ? THEN MAX(best_streak, current_streak + 1) ELSE best_streak END,
+                    last_play = CURRENT_TIMESTAMP, last_play_ts = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE user_id = ?
+                    RETURNING *
+                ''', (total, score, score, score, total, duration,
+                      total, score, total, perfect, perfect, user_id))
+                stats = UserStats.from_row(cursor.fetchone())
+                
+                # Save detailed game history
+                cursor.execute('''
+                    INSERT INTO game_history 
+                    (user_id, level, mode, score, total_questions, percentage, duration, grade, 
+                     questions_data, answers_data, deck_seed, deck_version, played_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+                ''', (user_id, level, mode, score, total,
+                      quiz_result['percentage'], duration,
+                      quiz_result['grade'], 
+                      GAME_RECORD_CODEC.encode_questions(questions) if deck_seed is None else None,
+                      GAME_RECORD_CODEC.encode_answers(questions, quiz_result.get('answers', []),
+                                                       quiz_result.get('start_time', time.time())),
+                      deck_seed, quiz_result.get('deck_version') if deck_seed is not None else None))
+                
+                # Checkpoint session selesai bersama hasilnya
+                cursor.execute('DELETE FROM quiz_session_state WHERE user_id = ?', (user_id,))
+                
+                conn.commit()
+            return counters, stats
             
         except Exception as e:
             logger.error(f"Error updating user stats: {e}")
+            return None
     
     def get_user_info(self, user):
         """Mendapatkan informasi user dengan aman"""
@@ -428,31 +2707,68 @@ class PremiumHiraganaQuizBot:
     
     def get_romaji_image_path(self, romaji: str) -> Optional[str]:
         """Mendapatkan path gambar untuk romaji tertentu"""
-        image_mapping = {}
-        for hiragana, romaji_val in HIRAGANA_DATA.items():
-            image_mapping[romaji_val] = f"{romaji_val}.jpg"
-        
-        filename = image_mapping.get(romaji)
-        if filename and os.path.exists(filename):
-            return filename
-        return None
+        return self.image_cache.path_for(romaji)
+    
+    def _save_image_file_id(self, romaji: str, file_id: Optional[str]):
+        """Simpan/hapus file_id gambar di database"""
+        with self.get_db_connection() as conn:
+            if file_id:
+                conn.execute('''
+                    INSERT INTO image_file_ids (romaji, file_id, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(romaji) DO UPDATE SET
+                        file_id = excluded.file_id, updated_at = excluded.updated_at
+                ''', (romaji, file_id))
+            else:
+                conn.execute('DELETE FROM image_file_ids WHERE romaji = ?', (romaji,))
+            conn.commit()
+    
+    async def remember_image_file_id(self, romaji: str, message):
+        """Cache file_id dari foto yang baru di-upload"""
+        if not message or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        if self.image_cache.remember(romaji, file_id):
+            try:
+                await self.db.write(self._save_image_file_id, romaji, file_id)
+            except Exception as e:
+                logger.warning(f"Could not persist image file_id for {romaji}: {e}")
     
     async def send_quiz_with_image(self, chat_id: int, message_text: str, romaji: str, reply_markup: InlineKeyboardMarkup):
         """Mengirim quiz dengan gambar romaji dalam satu pesan"""
+        bot = self.outbound.bot(OutboundScheduler.INTERACTIVE)
         try:
+            # Kirim pakai file_id yang sudah di-cache (tanpa upload ulang)
+            file_id = self.image_cache.file_id_for(romaji)
+            if file_id:
+                try:
+                    await bot.send_photo(
+                        chat_id=chat_id,
+                        photo=file_id,
+                        caption=message_text,
+                        reply_markup=reply_markup,
+                        parse_mode='Markdown'
+                    )
+                    return True
+                except BadRequest as e:
+                    logger.info(f"Cached file_id for {romaji} rejected, re-uploading: {e}")
+                    self.image_cache.forget(romaji)
+                    await self.db.write(self._save_image_file_id, romaji, None)
+            
             image_path = self.get_romaji_image_path(romaji)
             if image_path:
                 with open(image_path, 'rb') as photo:
-                    await self.application.bot.send_photo(
+                    message = await bot.send_photo(
                         chat_id=chat_id,
                         photo=photo,
                         caption=message_text,
                         reply_markup=reply_markup,
                         parse_mode='Markdown'
                     )
+                await self.remember_image_file_id(romaji, message)
                 return True
             else:
-                await self.application.bot.send_message(
+                await bot.send_message(
                     chat_id=chat_id,
                     text=message_text,
                     reply_markup=reply_markup,
@@ -461,7 +2777,7 @@ class PremiumHiraganaQuizBot:
                 return False
         except Exception as e:
             logger.error(f"Error sending quiz with image: {e}")
-            await self.application.bot.send_message(
+            await bot.send_message(
                 chat_id=chat_id,
                 text=message_text,
                 reply_markup=reply_markup,
@@ -469,41 +2785,245 @@ class PremiumHiraganaQuizBot:
             )
             return False
 
-    async def send_premium_track_record(self, user_info: dict, quiz_result: dict):
-        """Mengirim track record ke owner"""
+    async def edit_quiz_with_image(self, message, message_text: str, romaji: str, reply_markup: InlineKeyboardMarkup) -> bool:
+        """Ganti soal di pesan yang sama dengan satu API call, return False jika harus kirim ulang"""
+        if message is None:
+            return False
+        
+        bot = self.outbound.bot(OutboundScheduler.INTERACTIVE)
+        target = {'chat_id': message.chat_id, 'message_id': message.message_id}
         try:
-            track_message = f"""
-🎯 **💎 TRACK RECORD 💎**
-
-👤 **User Info:**
-• ID: `{user_info['id']}`
-• Username: @{user_info['username']}
-• Name: {user_info['full_name']}
-• Language: {user_info.get('language_code', 'unknown')}
-
-📊 **Quiz Performance:**
-• Level: {quiz_result['level']} • Mode: {quiz_result['mode'].title()}
-• Score: {quiz_result['score']}/{quiz_result['total']} ({quiz_result['percentage']:.1f}%)
-• Grade: {quiz_result['grade']} • Time: {quiz_result['duration']}
-
-📈 **User Statistics:**
-• Total Games: {quiz_result['user_stats']['total_games']}
-• Best Score Lv{quiz_result['level']}: {quiz_result['user_stats']['best_scores'][quiz_result['level']]}/13
-• Level {quiz_result['level']} Plays: {quiz_result['user_stats']['level_plays'][quiz_result['level']]}
-• Current Streak: {quiz_result['user_stats']['current_streak']}
-• Best Streak: {quiz_result['user_stats']['best_streak']}
-
-⏰ **Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            """
+            image_path = self.get_romaji_image_path(romaji)
+            if not message.photo:
+                # Pesan teks tidak bisa diubah jadi foto
+                if image_path:
+                    return False
+                await bot.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown', **target)
+                return True
+            
+            if not image_path:
+                await bot.edit_message_caption(caption=message_text, reply_markup=reply_markup, parse_mode='Markdown', **target)
+                return True
+            
+            file_id = self.image_cache.file_id_for(romaji)
+            if file_id:
+                try:
+                    await bot.edit_message_media(
+                        media=InputMediaPhoto(file_id, caption=message_text, parse_mode='Markdown'),
+                        reply_markup=reply_markup,
+                        **target
+                    )
+                    return True
+                except BadRequest as e:
+                    logger.info(f"Cached file_id for {romaji} rejected on edit, re-uploading: {e}")
+                    self.image_cache.forget(romaji)
+                    await self.db.write(self._save_image_file_id, romaji, None)
+            
+            with open(image_path, 'rb') as photo:
+                edited = await bot.edit_message_media(
+                    media=InputMediaPhoto(photo, caption=message_text, parse_mode='Markdown'),
+                    reply_markup=reply_markup,
+                    **target
+                )
+            if edited is not True:
+                await self.remember_image_file_id(romaji, edited)
+            return True
+        except Exception as e:
+            logger.warning(f"In-place question edit failed, resending: {e}")
+            return False
+
+    def send_premium_track_record(self, user_info: dict, quiz_result: dict):
+        """Masukkan track record ke digest owner (tidak menahan layar hasil player)"""
+        try:
+            if self.track_digest.add(TrackRecordDigest.build_entry(user_info, quiz_result)):
+                self.application.create_task(self.flush_track_records())
+        except Exception as e:
+            logger.error(f"Failed to queue premium track record: {e}")
+    
+    async def flush_track_records(self):
+        """Kirim digest track record ke owner: ringkasan + file JSONL"""
+        async with self.track_digest_lock:
+            batch = self.track_digest.drain()
+            if not batch:
+                return
+            try:
+                caption, payload = TrackRecordDigest.render(batch)
+                stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                await self.outbound.bot(OutboundScheduler.OWNER).send_document(
+                    chat_id=OWNER_ID,
+                    document=io.BytesIO(payload),
+                    filename=f"track_record_{stamp}.jsonl",
+                    caption=caption
+                )
+            except RetryAfter as e:
+                logger.warning(f"Track record digest rate limited, retrying in {e.retry_after}s")
+                self.track_digest.restore(batch)
+            except Exception as e:
+                logger.error(f"Failed to send track record digest: {e}")
+                self.track_digest.restore(batch)
+    
+    async def track_record_loop(self):
+        """Kirim digest track record secara periodik"""
+        while True:
+            await asyncio.sleep(TRACK_RECORD_DIGEST_INTERVAL)
+            await self.flush_track_records()
+
+    # DATABASE QUERIES (dijalankan di thread executor)
+    def _fetch_user_list(self, direction: str = 'next', last_active: Optional[str] = None,
+                         user_id: Optional[int] = None) -> Tuple[List[Tuple], bool]:
+        """Satu halaman user terakhir aktif (keyset pada (last_active, user_id)), return (rows, masih ada halaman)"""
+        if last_active is None:
+            where, order, params = '', 'DESC', ()
+        elif direction == 'next':
+            where, order, params = 'WHERE (u.last_active, u.user_id) < (?, ?)', 'DESC', (last_active, user_id)
+        else:
+            where, order, params = 'WHERE (u.last_active, u.user_id) > (?, ?)', 'ASC', (last_active, user_id)
+        
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Range scan di idx_users_activity_cursor, join user_stats hanya untuk row di halaman ini
+            cursor.execute(f'''
+                SELECT u.user_id, u.username, u.first_name, u.last_name, 
+                       u.last_active, u.total_messages,
+                       s.total_games, s.total_questions, s.total_correct
+                FROM users u
+                LEFT JOIN user_stats s ON u.user_id = s.user_id
+                {where}
+                ORDER BY u.last_active {order}, u.user_id {order}
+                LIMIT ?
+            ''', params + (USER_LIST_PAGE_SIZE + 1,))
+            rows = cursor.fetchall()
+        
+        has_more = len(rows) > USER_LIST_PAGE_SIZE
+        rows = rows[:USER_LIST_PAGE_SIZE]
+        if order == 'ASC':
+            rows.reverse()
+        return rows, has_more
+    
+    def _fetch_user_info(self, user_id: int) -> Tuple[Optional[Tuple], Optional[Tuple], List[Tuple]]:
+        """Query profil, statistik dan game terakhir seorang user"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get user info
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            user_data = cursor.fetchone()
+            if not user_data:
+                return None, None, []
+            
+            # Get user stats
+            cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
+            stats_data = cursor.fetchone()
+            
+            # Get recent games
+            cursor.execute('''
+                SELECT level, mode, score, total_questions, percentage, grade, timestamp
+                FROM game_history WHERE user_id = ? 
+                ORDER BY timestamp DESC LIMIT 5
+            ''', (user_id,))
+            return user_data, stats_data, cursor.fetchall()
+    
+    def _fetch_game_history(self, user_id: int, limit: int) -> Tuple[Optional[Tuple], List[Tuple]]:
+        """Query nama user dan history game terakhir"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get user name first
+            cursor.execute('SELECT first_name, last_name FROM users WHERE user_id = ?', (user_id,))
+            user_data = cursor.fetchone()
+            if not user_data:
+                return None, []
+            
+            # Get game history
+            cursor.execute('''
+                SELECT level, mode, score, total_questions, percentage, grade, duration, timestamp
+                FROM game_history WHERE user_id = ? 
+                ORDER BY timestamp DESC LIMIT ?
+            ''', (user_id, limit))
+            return user_data, cursor.fetchall()
+    
+    def _fetch_admin_stats(self) -> Dict:
+        """Query statistik berbasis waktu untuk admin dashboard (range scan ter-index)"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            data = {}
+            
+            # Rentang waktu pakai kolom epoch yang ter-index (UTC, sama seperti DATE("now"))
+            today_start = int(datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+            week_start = today_start - 7 * 86400
+            
+            cursor.execute('SELECT COUNT(*) FROM user_stats WHERE last_play_ts >= ?', (today_start,))
+            data['active_today'] = cursor.fetchone()[0]
             
-            await self.application.bot.send_message(
-                chat_id=OWNER_ID,
-                text=track_message,
-                parse_mode='Markdown'
-            )
+            cursor.execute('SELECT COUNT(*) FROM user_stats WHERE last_play_ts >= ?', (week_start,))
+            data['active_week'] = cursor.fetchone()[0]
             
-        except Exception as e:
-            logger.error(f"Failed to send premium track record: {e}")
+            cursor.execute('SELECT COUNT(*) FROM game_history WHERE played_at >= ?', (today_start,))
+            data['games_today'] = cursor.fetchone()[0]
+            return data
+
+    def _recompute_global_counters(self) -> Dict[str, int]:
+        """Hitung ulang global_counters dari tabel sumber"""
+        with self.get_db_connection() as conn:
+            values = recompute_global_counters(conn.cursor())
+            conn.commit()
+            return values
+
+    def _export_table(self, table: str, fmt: str, path: str, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None, user_id: Optional[int] = None) -> int:
+        """Stream satu tabel ke file gzip CSV/JSONL (fetchmany, memori konstan), return jumlah row"""
+        query, date_column, date_kind = EXPORT_TABLES[table]
+        conditions, params = [], []
+        for op, bound in (('>=', since), ('<', until)):
+            if bound is not None:
+                conditions.append(f'{date_column} {op} ?')
+                params.append(int(bound.timestamp()) if date_kind == 'epoch' else bound.strftime('%Y-%m-%d %H:%M:%S'))
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        
+        count = 0
+        with self.get_db_connection() as conn, gzip.open(path, 'wt', encoding='utf-8', newline='') as out:
+            cursor = conn.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            # answers_data biner ditulis sebagai string benar/salah, soal (legacy maupun seed) sebagai teks
+            answers_index = columns.index('answers_data') if 'answers_data' in columns else None
+            if answers_index is not None:
+                columns[answers_index] = 'answers'
+            questions_index = columns.index('questions_data') if 'questions_data' in columns else None
+            if questions_index is not None:
+                columns[questions_index] = 'questions'
+                deck_indices = [columns.index(name) for name in ('level', 'mode', 'deck_seed', 'deck_version')]
+            writer = csv.writer(out) if fmt == 'csv' else None
+            if writer:
+                writer.writerow(columns)
+            
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    if questions_index is not None:
+                        row = list(row)
+                        try:
+                            row[questions_index] = GAME_RECORD_CODEC.questions_text(
+                                row[questions_index], *(row[i] for i in deck_indices))
+                        except (ValueError, KeyError, TypeError, IndexError):
+                            row[questions_index] = None
+                    if answers_index is not None:
+                        row = list(row)
+                        try:
+                            row[answers_index] = GAME_RECORD_CODEC.correctness(row[answers_index])
+                        except (ValueError, KeyError, TypeError):
+                            row[answers_index] = None
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+                count += len(rows)
+        return count
 
     # OWNER COMMANDS
     async def user_list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -513,36 +3033,50 @@ class PremiumHiraganaQuizBot:
             return
         
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT u.user_id, u.username, u.first_name, u.last_name, 
-                       u.created_at, u.last_active, u.total_messages,
-                       s.total_games, s.total_questions, s.total_correct
-                FROM users u
-                LEFT JOIN user_stats s ON u.user_id = s.user_id
-                ORDER BY u.last_active DESC
-                LIMIT 20
-            ''')
-            
-            users = cursor.fetchall()
-            conn.close()
+            users, has_more = await self.db.read(self._fetch_user_list)
             
             if not users:
                 await update.message.reply_text("📝 No users found.")
                 return
             
-            user_list_text = "👥 **Recent Active Users (Top 20):**\n\n"
+            text, reply_markup = self.render_user_list(users, has_prev=False, has_next=has_more)
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
             
-            for user in users:
-                user_id, username, first_name, last_name, created_at, last_active, total_msgs, total_games, total_q, total_c = user
-                
-                full_name = f"{first_name or 'Unknown'} {last_name or ''}".strip()
-                username_display = f"@{username}" if username else "No username"
-                accuracy = (total_c / total_q * 100) if total_q and total_q > 0 else 0
-                
-                user_list_text += f"""
+        except Exception as e:
+            logger.error(f"Error in user_list_command: {e}")
+            await update.message.reply_text("❌ Error retrieving user list.")
+    
+    async def user_list_page(self, query, data: str):
+        """Pindah halaman /userlist dari tombol inline (callback ul_<next|prev>_<user_id>_<last_active>)"""
+        if query.from_user.id != OWNER_ID:
+            return
+        
+        _, direction, user_id, last_active = data.split("_", 3)
+        users, has_more = await self.db.read(self._fetch_user_list, direction, last_active, int(user_id))
+        if not users:
+            # Cursor di ujung daftar (misalnya user berpindah urutan karena baru aktif): mulai dari awal
+            users, has_more = await self.db.read(self._fetch_user_list)
+            has_prev, has_next = False, has_more
+        elif direction == 'next':
+            has_prev, has_next = True, has_more
+        else:
+            has_prev, has_next = has_more, True
+        
+        text, reply_markup = self.render_user_list(users, has_prev, has_next)
+        await self.safe_edit_message(query, text, reply_markup)
+    
+    def render_user_list(self, users: List[Tuple], has_prev: bool, has_next: bool) -> Tuple[str, InlineKeyboardMarkup]:
+        """Teks satu halaman /userlist dan tombol navigasinya"""
+        user_list_text = "👥 **Recent Active Users:**\n\n"
+        
+        for user in users:
+            user_id, username, first_name, last_name, last_active, total_msgs, total_games, total_q, total_c = user
+            
+            full_name = f"{first_name or 'Unknown'} {last_name or ''}".strip()
+            username_display = f"@{username}" if username else "No username"
+            accuracy = (total_c / total_q * 100) if total_q and total_q > 0 else 0
+            
+            user_list_text += f"""
 **{full_name}**
 • ID: `{user_id}`
 • Username: {username_display}
@@ -550,12 +3084,16 @@ class PremiumHiraganaQuizBot:
 • Messages: {total_msgs or 0}
 • Last Active: {last_active[:10] if last_active else 'Unknown'}
                 """
-            
-            await update.message.reply_text(user_list_text, parse_mode='Markdown')
-            
-        except Exception as e:
-            logger.error(f"Error in user_list_command: {e}")
-            await update.message.reply_text("❌ Error retrieving user list.")
+        
+        # Cursor = (last_active, user_id) row pertama/terakhir di halaman ini
+        navigation = []
+        if has_prev:
+            first = users[0]
+            navigation.append(InlineKeyboardButton("◀️ Prev", callback_data=f"ul_prev_{first[0]}_{first[4]}"))
+        if has_next:
+            last = users[-1]
+            navigation.append(InlineKeyboardButton("Next ▶️", callback_data=f"ul_next_{last[0]}_{last[4]}"))
+        return user_list_text, InlineKeyboardMarkup([navigation] if navigation else [])
 
     async def user_info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Command untuk melihat info detail user (owner only)"""
@@ -570,31 +3108,12 @@ class PremiumHiraganaQuizBot:
         try:
             user_id = int(context.args[0])
             
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get user info
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            user_data = cursor.fetchone()
+            user_data, stats_data, recent_games = await self.db.read(self._fetch_user_info, user_id)
             
             if not user_data:
                 await update.message.reply_text("❌ User not found.")
                 return
             
-            # Get user stats
-            cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
-            stats_data = cursor.fetchone()
-            
-            # Get recent games
-            cursor.execute('''
-                SELECT level, mode, score, total_questions, percentage, grade, timestamp
-                FROM game_history WHERE user_id = ? 
-                ORDER BY timestamp DESC LIMIT 5
-            ''', (user_id,))
-            recent_games = cursor.fetchall()
-            
-            conn.close()
-            
             # Format user info
             username = f"@{user_data[1]}" if user_data[1] else "No username"
             full_name = f"{user_data[2] or 'Unknown'} {user_data[3] or ''}".strip()
@@ -668,12 +3187,7 @@ class PremiumHiraganaQuizBot:
             limit = int(context.args[1]) if len(context.args) > 1 else 10
             limit = min(limit, 50)  # Max 50 records
             
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get user name first
-            cursor.execute('SELECT first_name, last_name FROM users WHERE user_id = ?', (user_id,))
-            user_data = cursor.fetchone()
+            user_data, games = await self.db.read(self._fetch_game_history, user_id, limit)
             
             if not user_data:
                 await update.message.reply_text("❌ User not found.")
@@ -681,16 +3195,6 @@ class PremiumHiraganaQuizBot:
             
             full_name = f"{user_data[0] or 'Unknown'} {user_data[1] or ''}".strip()
             
-            # Get game history
-            cursor.execute('''
-                SELECT level, mode, score, total_questions, percentage, grade, duration, timestamp
-                FROM game_history WHERE user_id = ? 
-                ORDER BY timestamp DESC LIMIT ?
-            ''', (user_id, limit))
-            
-            games = cursor.fetchall()
-            conn.close()
-            
             if not games:
                 await update.message.reply_text(f"📝 No game history found for {full_name}.")
                 return
@@ -717,6 +3221,79 @@ class PremiumHiraganaQuizBot:
             logger.error(f"Error in game_history_command: {e}")
             await update.message.reply_text("❌ Error retrieving game history.")
 
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Command untuk export tabel sebagai file gzip (owner only)"""
+        if update.effective_user.id != OWNER_ID:
+            await update.message.reply_text("❌ Access denied.")
+            return
+        
+        usage = ("📝 Usage: /export <users|stats|games> [csv|jsonl] "
+                 "[from=YYYY-MM-DD] [to=YYYY-MM-DD] [user=<user_id>]")
+        if not context.args or context.args[0] not in EXPORT_TABLES:
+            await update.message.reply_text(usage)
+            return
+        
+        table, fmt = context.args[0], 'csv'
+        since = until = user_id = None
+        try:
+            for arg in context.args[1:]:
+                if arg in EXPORT_FORMATS:
+                    fmt = arg
+                elif arg.startswith('from='):
+                    since = datetime.strptime(arg[5:], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                elif arg.startswith('to='):
+                    # Tanggal akhir inklusif
+                    until = datetime.strptime(arg[3:], '%Y-%m-%d').replace(tzinfo=timezone.utc) + timedelta(days=1)
+                elif arg.startswith('user='):
+                    user_id = int(arg[5:])
+                else:
+                    raise ValueError(arg)
+        except ValueError:
+            await update.message.reply_text(f"❌ Invalid export option.\n\n{usage}")
+            return
+        
+        if self.export_lock.locked():
+            await update.message.reply_text("⏳ Another export is still running.")
+            return
+        
+        async with self.export_lock:
+            path = None
+            try:
+                status = await update.message.reply_text(f"⏳ Exporting {table} as {fmt}...")
+                fd, path = tempfile.mkstemp(prefix=f"export_{table}_", suffix=f".{fmt}.gz")
+                os.close(fd)
+                
+                # Thread terpisah: export besar tidak memakai slot read pool
+                started = time.monotonic()
+                rows = await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self._export_table, table, fmt, path, since, until, user_id))
+                elapsed = time.monotonic() - started
+                size = os.path.getsize(path)
+                
+                if size > EXPORT_MAX_BYTES:
+                    await status.edit_text(f"❌ Export is {size / 1024 / 1024:.1f} MB, over the 50 MB upload limit. "
+                                           f"Narrow it with from=/to=/user= filters.")
+                    return
+                
+                filename = f"{table}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}.gz"
+                with open(path, 'rb') as document:
+                    # Default PTB (write_timeout=20) terlalu pendek untuk file puluhan MB
+                    await update.message.reply_document(
+                        document=document,
+                        filename=filename,
+                        caption=f"📦 {table}: {rows:,} rows, {size / 1024:.1f} KiB gzip ({elapsed:.1f}s)",
+                        write_timeout=max(HTTP_MEDIA_WRITE_TIMEOUT, size / EXPORT_UPLOAD_MIN_RATE),
+                        read_timeout=EXPORT_UPLOAD_READ_TIMEOUT
+                    )
+                await status.delete()
+                
+            except Exception as e:
+                logger.error(f"Error in export_command: {e}")
+                await update.message.reply_text("❌ Error exporting data.")
+            finally:
+                if path is not None:
+                    os.remove(path)
+
     async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Command untuk broadcast message ke semua user (owner only)"""
         if update.effective_user.id != OWNER_ID:
@@ -730,57 +3307,18 @@ class PremiumHiraganaQuizBot:
         message = ' '.join(context.args)
         
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT user_id FROM users WHERE status = "active"')
-            users = cursor.fetchall()
-            conn.close()
-            
-            if not users:
-                await update.message.reply_text("📝 No active users found.")
-                return
-            
-            success_count = 0
-            failed_count = 0
-            
             broadcast_message = f"📢 **BROADCAST MESSAGE**\n\n{message}\n\n---\nFrom: Hiragana Master Pro Admin"
             
-            status_msg = await update.message.reply_text(f"📡 Starting broadcast to {len(users)} users...")
-            
-            for user_tuple in users:
-                user_id = user_tuple[0]
-                try:
-                    await self.application.bot.send_message(
-                        chat_id=user_id,
-                        text=broadcast_message,
-                        parse_mode='Markdown'
-                    )
-                    success_count += 1
-                    
-                    # Update progress every 10 users
-                    if success_count % 10 == 0:
-                        await status_msg.edit_text(
-                            f"📡 Broadcasting... {success_count}/{len(users)} sent"
-                        )
-                    
-                    await asyncio.sleep(0.1)  # Rate limiting
-                    
-                except Exception as e:
-                    failed_count += 1
-                    logger.warning(f"Failed to send broadcast to {user_id}: {e}")
+            status_msg = await update.message.reply_text("📡 Queuing broadcast...")
+            job_id, total = await self.broadcast_engine.submit(
+                broadcast_message, status_msg.chat_id, status_msg.message_id
+            )
             
-            final_message = f"""
-✅ **Broadcast Complete!**
-
-📊 **Results:**
-• Total Users: {len(users)}
-• Successfully Sent: {success_count}
-• Failed: {failed_count}
-• Success Rate: {(success_count/len(users)*100):.1f}%
-            """
+            if total == 0:
+                await status_msg.edit_text("📝 No active users found.")
+                return
             
-            await status_msg.edit_text(final_message, parse_mode='Markdown')
+            await status_msg.edit_text(f"📡 Broadcast #{job_id} started to {total} users...")
             
         except Exception as e:
             logger.error(f"Error in broadcast_command: {e}")
@@ -791,7 +3329,7 @@ class PremiumHiraganaQuizBot:
         # Hanya track user activity, tidak perlu response khusus
         if update.effective_user:
             user_info = self.get_user_info(update.effective_user)
-            self.init_user(
+            await self.init_user(
                 update.effective_user.id,
                 user_info['username'],
                 user_info['first_name'],
@@ -805,7 +3343,7 @@ class PremiumHiraganaQuizBot:
             user = update.effective_user
             user_info = self.get_user_info(user)
             
-            self.init_user(
+            await self.init_user(
                 user.id, 
                 user_info['username'], 
                 user_info['first_name'], 
@@ -825,11 +3363,12 @@ class PremiumHiraganaQuizBot:
                 [
                     InlineKeyboardButton("📊 My Statistics", callback_data="my_stats"),
                     InlineKeyboardButton("💡 How to Play", callback_data="help")
-                ]
+                ],
+                [InlineKeyboardButton("🏆 Leaderboard", callback_data="lb_overall")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            user_stats = self.get_user_stats(user.id)
+            user_stats = await self.get_user_stats(user.id)
             welcome_text = f"""
 💎 **Hiragana Master Pro** 💎
 
@@ -873,6 +3412,50 @@ class PremiumHiraganaQuizBot:
             logger.error(f"Error in stats_command: {e}")
             await update.message.reply_text("❌ Error retrieving statistics.")
 
+    async def leaderboard_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler untuk command /leaderboard [level]"""
+        try:
+            board = LeaderboardIndex.OVERALL
+            if context.args and context.args[0].isdigit() and int(context.args[0]) in LEVELS:
+                board = int(context.args[0])
+            text, reply_markup = self.render_leaderboard(board, update.effective_user.id)
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Error in leaderboard_command: {e}")
+            await update.message.reply_text("❌ Error retrieving leaderboard.")
+    
+    def render_leaderboard(self, board, user_id: int) -> Tuple[str, InlineKeyboardMarkup]:
+        """Teks top-K + peringkat user sendiri, dengan tombol pindah board"""
+        def describe(key: Tuple) -> str:
+            if board == LeaderboardIndex.OVERALL:
+                return f"{-key[0] * 100:.1f}% ({-key[1]} games)"
+            return f"{-key[0]}/{QUESTIONS_PER_QUIZ} ({-key[1]} plays)"
+        
+        title = "Overall Accuracy" if board == LeaderboardIndex.OVERALL else f"Level {board} Best Score"
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        text = f"🏆 **Leaderboard - {title}**\n"
+        
+        top = self.leaderboard.top(board)
+        if not top:
+            text += "\nNo players yet. Be the first! 🚀"
+        for rank, ranked_user_id, name, key in top:
+            you = " 👈" if ranked_user_id == user_id else ""
+            text += f"\n{medals.get(rank, f'{rank}.')} {name}: {describe(key)}{you}"
+        
+        rank = self.leaderboard.rank(board, user_id)
+        if rank is None:
+            text += "\n\n📍 **Your Rank:** not ranked yet - play a quiz!"
+        else:
+            text += (f"\n\n📍 **Your Rank:** #{rank} of {self.leaderboard.size(board)} "
+                     f"- {describe(self.leaderboard.entry(board, user_id))}")
+        
+        keyboard = [
+            [InlineKeyboardButton("🌐 Overall", callback_data="lb_overall")] +
+            [InlineKeyboardButton(f"L{level}", callback_data=f"lb_{level}") for level in LEVELS],
+            [InlineKeyboardButton("🏠 Back to Menu", callback_data="back_to_menu")]
+        ]
+        return text, InlineKeyboardMarkup(keyboard)
+
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handler untuk command /help"""
         help_text = """
@@ -901,6 +3484,7 @@ class PremiumHiraganaQuizBot:
 📊 **Commands:**
 • /start - Main menu
 • /stats - Your statistics
+• /leaderboard - Top players (add 1-4 for a level)
 • /help - This guide
 
 🖼️ **New Feature:**
@@ -918,65 +3502,65 @@ Each question shows ROMAJI illustration, you choose the correct HIRAGANA charact
             return
         
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Basic statistics
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_stats WHERE DATE(last_play) = DATE("now")')
-            active_today = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_stats WHERE DATE(last_play) >= DATE("now", "-7 days")')
-            active_week = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT SUM(total_games) FROM user_stats')
-            total_games = cursor.fetchone()[0] or 0
+            data = await self.db.read(self._fetch_admin_stats)
+            counters = self.global_counters
+            session_stats = self.sessions.stats()
+            cache_stats = self.stats_cache.stats()
             
-            cursor.execute('SELECT SUM(total_questions) FROM user_stats')
-            total_questions = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT SUM(total_correct) FROM user_stats')
-            total_correct = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT SUM(total_time_played) FROM user_stats')
-            total_time = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT COUNT(*) FROM game_history WHERE DATE(timestamp) = DATE("now")')
-            games_today = cursor.fetchone()[0]
-            
-            avg_accuracy = (total_correct / total_questions * 100) if total_questions > 0 else 0
+            total_users = counters['total_users']
+            active_week = data['active_week']
+            total_questions = counters['total_questions']
+            total_time = counters['total_time_played']
+            avg_accuracy = (counters['total_correct'] / total_questions * 100) if total_questions > 0 else 0
             
             stats_text = f"""
 📊 **💎 Admin Dashboard 💎**
 
 👥 **Users:**
 • Total Users: {total_users}
-• Active Today: {active_today}
+• Active Today: {data['active_today']}
 • Active This Week: {active_week}
 • Retention Rate: {(active_week/total_users*100) if total_users > 0 else 0:.1f}%
 
 🎮 **Games:**
-• Total Games: {total_games}
-• Games Today: {games_today}
+• Total Games: {counters['total_games']}
+• Games Today: {data['games_today']}
 • Total Questions: {total_questions:,}
 • Average Accuracy: {avg_accuracy:.1f}%
 • Total Play Time: {total_time//3600}h {(total_time%3600)//60}m
 
+🧠 **Live Sessions:**
+• Active Quizzes: {session_stats['live']}/{session_stats['max_size']}
+• Memory Estimate: {session_stats['memory_bytes'] / 1024:.1f} KiB
+• Stats Cache: {cache_stats['size']}/{cache_stats['max_size']} ({cache_stats['hit_rate']:.1f}% hit, {cache_stats['hits']}/{cache_stats['misses']} hit/miss)
+
+🌐 **HTTP Pools:**"""
+            
+            for lane in self.http_request.lanes() + [self.get_updates_request]:
+                pool = lane.stats()
+                stats_text += (f"\n• {pool['name']}: {pool['in_flight']}/{pool['pool_size']} busy "
+                               f"(peak {pool['peak_in_flight']}), {pool['requests']} req, "
+                               f"wait {pool['avg_wait_ms']:.1f}/{pool['max_wait_ms']:.0f} ms, "
+                               f"{pool['errors']} err")
+            
+            stats_text += "\n\n📮 **Outbound Queue:**"
+            for queue_class in self.outbound.stats():
+                stats_text += (f"\n• {queue_class['name'].title()}: {queue_class['depth']} queued, "
+                               f"{queue_class['sent']} sent, {queue_class['failed']} failed, "
+                               f"{queue_class['shed']} shed, wait {queue_class['avg_wait_ms']:.0f}/"
+                               f"{queue_class['max_wait_ms']:.0f} ms")
+            
+            stats_text += """
+
 📈 **Level Distribution:"""
             
-            for level in range(1, 5):
-                cursor.execute(f'SELECT SUM(level{level}_plays) FROM user_stats')
-                level_plays = cursor.fetchone()[0] or 0
-                cursor.execute(f'SELECT AVG(best_score_level{level}) FROM user_stats WHERE level{level}_plays > 0')
-                avg_score = cursor.fetchone()[0] or 0
-                stats_text += f"\n• Level {level}: {level_plays} games (avg: {avg_score:.1f}/13)"
+            for level in LEVELS:
+                players = counters[f'level{level}_players']
+                avg_score = counters[f'level{level}_best_sum'] / players if players > 0 else 0
+                stats_text += f"\n• Level {level}: {counters[f'level{level}_plays']} games (avg: {avg_score:.1f}/13)"
             
-            cursor.execute('SELECT SUM(easy_games), SUM(hard_games) FROM user_stats')
-            mode_data = cursor.fetchone()
-            easy_games = mode_data[0] or 0
-            hard_games = mode_data[1] or 0
+            easy_games = counters['easy_games']
+            hard_games = counters['hard_games']
             
             stats_text += f"""
 
@@ -986,37 +3570,52 @@ Each question shows ROMAJI illustration, you choose the correct HIRAGANA charact
 
 🏆 **Top Performers:**"""
             
-            cursor.execute('''
-                SELECT u.first_name, u.last_name, s.total_games, 
-                       (s.total_correct * 100.0 / s.total_questions) as accuracy
-                FROM users u JOIN user_stats s ON u.user_id = s.user_id 
-                WHERE s.total_questions > 0
-                ORDER BY accuracy DESC, s.total_games DESC LIMIT 5
-            ''')
-            
-            top_users = cursor.fetchall()
-            for i, user in enumerate(top_users, 1):
-                name = f"{user[0] or 'Unknown'} {user[1] or ''}".strip()
-                stats_text += f"\n{i}. {name}: {user[3]:.1f}% ({user[2]} games)"
+            for rank, _, name, key in self.leaderboard.top(LeaderboardIndex.OVERALL, 5):
+                stats_text += f"\n{rank}. {name}: {-key[0] * 100:.1f}% ({-key[1]} games)"
             
             stats_text += f"""
 
 📅 **Updated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
             """
             
-            conn.close()
             await update.message.reply_text(stats_text, parse_mode='Markdown')
             
         except Exception as e:
             logger.error(f"Error in admin_stats_command: {e}")
             await update.message.reply_text("❌ Error retrieving admin statistics.")
 
+    async def recount_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Command untuk menghitung ulang counter global dari nol (owner only)"""
+        if update.effective_user.id != OWNER_ID:
+            await update.message.reply_text("❌ Access denied.")
+            return
+        
+        try:
+            await self.flush_activity()
+            before = dict(self.global_counters.values)
+            values = await self.db.write(self._recompute_global_counters)
+            self.global_counters.load(values)
+            
+            drift = [f"• {field}: {before.get(field, 0)} → {value}"
+                     for field, value in values.items() if before.get(field, 0) != value]
+            drift_text = "\n".join(drift) if drift else "• No drift detected"
+            
+            await update.message.reply_text(
+                f"🔄 **Global counters recomputed**\n\n{drift_text}",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.error(f"Error in recount_stats_command: {e}")
+            await update.message.reply_text("❌ Error recomputing statistics.")
+
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handler untuk semua callback dari inline keyboard - STABILIZED VERSION"""
         query = update.callback_query
         
-        # Jawab callback query dengan aman
-        callback_answered = await self.safe_answer_callback(query)
+        # Jawab callback query dengan aman (jawaban quiz dijawab sekali oleh handle_answer, dengan hasilnya)
+        callback_answered = False
+        if not (query.data or '').startswith("ans_"):
+            callback_answered = await self.safe_answer_callback(query)
         
         try:
             user_id = query.from_user.id
@@ -1040,6 +3639,13 @@ Each question shows ROMAJI illustration, you choose the correct HIRAGANA charact
                 await self.handle_answer(query, data)
             elif data == "my_stats":
                 await self.show_user_stats_callback(query)
+            elif data.startswith("ul_"):
+                await self.user_list_page(query, data)
+            elif data.startswith("lb_"):
+                board = data[3:]
+                board = int(board) if board.isdigit() and int(board) in LEVELS else LeaderboardIndex.OVERALL
+                text, reply_markup = self.render_leaderboard(board, user_id)
+                await self.safe_edit_message(query, text, reply_markup)
             elif data == "help":
                 await self.show_help_callback(query)
             elif data == "back_to_menu":
@@ -1118,127 +3724,63 @@ Choose your mode:
             logger.info(f"Starting quiz - User: {user_id}, Level: {level}, Mode: {mode}")
             
             # Clear any existing session
-            if user_id in quiz_sessions:
-                del quiz_sessions[user_id]
-            if user_id in used_romaji:
-                del used_romaji[user_id]
-            
-            # Reset used romaji untuk user ini
-            used_romaji[user_id] = []
-            
-            # Generate soal acak tanpa duplikat
-            available_hiragana = LEVELS[level].copy()
-            quiz_questions = []
-            
-            for i in range(13):
-                if not available_hiragana:
-                    available_hiragana = LEVELS[level].copy()
-                
-                char = random.choice(available_hiragana)
-                available_hiragana.remove(char)
-                
-                correct_romaji = HIRAGANA_DATA[char]
-                used_romaji[user_id].append(correct_romaji)
-                
-                if mode == "easy":
-                    # Correct answer adalah huruf hiragana yang sesuai dengan romaji
-                    correct_hiragana = char
-                    
-                    # Pilihan wrong answers: hiragana lain dari level yang sama
-                    wrong_hiragana = [h for h in LEVELS[level] if h != correct_hiragana]
-                    num_wrong = min(3, len(wrong_hiragana))
-                    
-                    if num_wrong > 0:
-                        selected_wrong = random.sample(wrong_hiragana, num_wrong)
-                    else:
-                        # Jika tidak ada cukup wrong answers dari level yang sama, ambil dari level lain
-                        all_other_hiragana = [h for h in HIRAGANA_DATA.keys() if h != correct_hiragana]
-                        selected_wrong = random.sample(all_other_hiragana, min(3, len(all_other_hiragana)))
-                    
-                    options_hiragana = selected_wrong + [correct_hiragana]
-                    random.shuffle(options_hiragana)
-                    
-                    question_data = {
-                        'type': 'multiple_choice',
-                        'romaji': correct_romaji,
-                        'correct_hiragana': correct_hiragana,
-                        'options_hiragana': options_hiragana,
-                        'correct_index': options_hiragana.index(correct_hiragana)
-                    }
-                else:
-                    # Hard mode: True/False dengan romaji dan hiragana
-                    all_hiragana = list(HIRAGANA_DATA.keys())
-                    wrong_hiragana = [h for h in all_hiragana if h != char]
-                    
-                    if random.random() < 0.5:
-                        displayed_hiragana = char
-                        is_correct = True
-                    else:
-                        displayed_hiragana = random.choice(wrong_hiragana) if wrong_hiragana else char
-                        is_correct = displayed_hiragana == char
-                    
-                    question_data = {
-                        'type': 'true_false',
-                        'romaji': correct_romaji,
-                        'correct_hiragana': char,
-                        'displayed_hiragana': displayed_hiragana,
-                        'is_correct': is_correct
-                    }
-                
-                quiz_questions.append(question_data)
-            
-            # Simpan session quiz
-            quiz_sessions[user_id] = {
-                'level': level,
-                'mode': mode,
-                'questions': quiz_questions,
-                'current_question': 0,
-                'score': 0,
-                'start_time': time.time(),
-                'time_limit': 180,
-                'user_answers': []
-            }
+            self.cancel_pending_transition(user_id)
+            self.sessions.pop(user_id)
+            
+            # Deck soal acak tanpa duplikat, bisa di-replay dari seed-nya
+            session = QuizSession.from_seed(
+                user_id=user_id,
+                chat_id=query.message.chat_id,
+                user_info=self.get_user_info(query.from_user),
+                level=level,
+                mode=mode,
+                seed=QUESTION_FACTORY.new_seed()
+            )
+            evicted = self.sessions.put(session)
+            await self.db.write(self._save_session_state, session.checkpoint_row())
+            if evicted is not None:
+                self.application.create_task(self.finish_evicted_session(evicted))
             
-            logger.info(f"Quiz session created for user {user_id} with {len(quiz_questions)} questions")
+            logger.info(f"Quiz session created for user {user_id} with {session.question_count} questions")
             await self.show_question(query, user_id)
             
         except Exception as e:
             logger.error(f"Error in start_quiz: {e}", exc_info=True)
             await self.send_error_message(query, "Error starting quiz")
 
-    async def show_question(self, query, user_id: int):
+    async def show_question(self, query, user_id: int, feedback: str = ""):
         """Menampilkan soal quiz dengan gambar romaji - STABILIZED"""
-        if user_id not in quiz_sessions:
+        session = self.sessions.get(user_id)
+        if session is None:
             await self.send_error_message(query, "Quiz session not found")
             return
         
         try:
-            session = quiz_sessions[user_id]
             
             # Cek waktu
-            elapsed_time = time.time() - session['start_time']
-            if elapsed_time > session['time_limit']:
+            elapsed_time = time.time() - session.start_time
+            if elapsed_time > session.time_limit:
                 await self.end_quiz(query, user_id, "⏰ Time's up!")
                 return
             
-            current_q = session['current_question']
-            if current_q >= len(session['questions']):
+            current_q = session.current_question
+            if current_q >= session.question_count:
                 await self.end_quiz(query, user_id, "✅ Quiz completed!")
                 return
             
-            question = session['questions'][current_q]
-            remaining_time = max(0, int(session['time_limit'] - elapsed_time))
+            question = session.question(current_q)
+            remaining_time = max(0, int(session.time_limit - elapsed_time))
             minutes = remaining_time // 60
             seconds = remaining_time % 60
             
-            mode_emoji = "😊" if session['mode'] == "easy" else "😤"
-            mode_text = "Easy Mode" if session['mode'] == "easy" else "Hard Mode"
+            mode_emoji = "😊" if session.mode == "easy" else "😤"
+            mode_text = "Easy Mode" if session.mode == "easy" else "Hard Mode"
             
             if question['type'] == 'multiple_choice':
                 question_text = f"""
-🎯 **Question {current_q + 1}/13** {mode_emoji} **{mode_text}**
+🎯 **Question {current_q + 1}/{session.question_count}** {mode_emoji} **{mode_text}**
 ⏰ Time Left: {minutes:02d}:{seconds:02d}
-📊 Current Score: {session['score']}/{current_q}
+📊 Current Score: {session.score}/{current_q}
 
 **Which Hiragana character represents this sound?**
 
@@ -1257,9 +3799,9 @@ Choose the correct Hiragana character:
             
             else:
                 question_text = f"""
-🎯 **Question {current_q + 1}/13** {mode_emoji} **{mode_text}**
+🎯 **Question {current_q + 1}/{session.question_count}** {mode_emoji} **{mode_text}**
 ⏰ Time Left: {minutes:02d}:{seconds:02d}
-📊 Current Score: {session['score']}/{current_q}
+📊 Current Score: {session.score}/{current_q}
 
 **True or False?**
 The Hiragana character **{question['displayed_hiragana']}** is read as **"{question['romaji']}"**
@@ -1276,9 +3818,20 @@ Choose your answer:
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
+            # Hasil jawaban sebelumnya ikut di caption (mode feedback inline)
+            if feedback:
+                question_text = f"\n{feedback}\n{question_text}"
+            
+            # Mode in-place: satu edit, kirim ulang hanya jika edit gagal
+            if QUESTION_RENDER_MODE == "edit" and await self.edit_quiz_with_image(
+                query.message, question_text, question['romaji'], reply_markup
+            ):
+                return
+            
             # Delete previous message safely
             try:
-                await query.message.delete()
+                await self.outbound.bot(OutboundScheduler.INTERACTIVE).delete_message(
+                    chat_id=query.message.chat_id, message_id=query.message.message_id)
             except Exception as e:
                 logger.warning(f"Could not delete previous message: {e}")
             
@@ -1296,6 +3849,19 @@ Choose your answer:
 
     async def handle_answer(self, query, callback_data: str):
         """Handle jawaban user - COMPLETELY STABILIZED VERSION"""
+        answered = False
+        
+        async def answer(text: Optional[str] = None):
+            # Telegram hanya menerima satu answerCallbackQuery per query
+            nonlocal answered
+            if answered:
+                return
+            answered = True
+            try:
+                await query.answer(text)
+            except Exception as e:
+                logger.warning(f"Could not answer callback: {e}")
+        
         try:
             logger.info(f"Processing answer: {callback_data}")
             
@@ -1303,7 +3869,7 @@ Choose your answer:
             parts = callback_data.split('_')
             if len(parts) < 5:
                 logger.error(f"Invalid callback data format: {callback_data}")
-                await query.answer("❌ Invalid answer format")
+                await answer("❌ Invalid answer format")
                 return
             
             answer_type = parts[1]  # 'mc' atau 'tf'
@@ -1313,7 +3879,7 @@ Choose your answer:
                 question_num = int(parts[3])
             except (ValueError, IndexError):
                 logger.error(f"Invalid user_id or question_num in callback: {callback_data}")
-                await query.answer("❌ Invalid data format")
+                await answer("❌ Invalid data format")
                 return
             
             user_id = query.from_user.id
@@ -1321,36 +3887,37 @@ Choose your answer:
             # Validasi user
             if user_id != user_id_from_callback:
                 logger.warning(f"User ID mismatch: {user_id} vs {user_id_from_callback}")
-                await query.answer("❌ Invalid user session")
+                await answer("❌ Invalid user session")
                 return
             
             # Check if session exists
-            if user_id not in quiz_sessions:
+            session = self.sessions.get(user_id)
+            if session is None:
                 logger.warning(f"No quiz session found for user {user_id}")
-                await query.answer("❌ Quiz session expired. Please /start")
+                await answer("❌ Quiz session expired. Please /start")
                 return
             
-            session = quiz_sessions[user_id]
-            current_q = session['current_question']
+            current_q = session.current_question
             
             # Validasi nomor soal
             if question_num != current_q:
                 logger.warning(f"Question mismatch: expected {current_q}, got {question_num}")
-                await query.answer("❌ Question expired")
+                await answer("❌ Question expired")
                 return
             
             # Check if quiz is finished
-            if current_q >= len(session['questions']):
+            if current_q >= session.question_count:
+                await answer()
                 await self.end_quiz(query, user_id, "✅ Quiz completed!")
                 return
                 
-            question = session['questions'][current_q]
+            question = session.question(current_q)
             
             # Process answer based on type
             if answer_type == 'mc':
                 if len(parts) < 5:
                     logger.error(f"Invalid MC callback data: {callback_data}")
-                    await query.answer("❌ Invalid multiple choice data")
+                    await answer("❌ Invalid multiple choice data")
                     return
                 
                 try:
@@ -1359,48 +3926,43 @@ Choose your answer:
                     # Validate index range
                     if option_index < 0 or option_index >= len(question['options_hiragana']):
                         logger.error(f"Option index out of range: {option_index}")
-                        await query.answer("❌ Invalid option selected")
+                        await answer("❌ Invalid option selected")
                         return
                     
                     user_answer_char = question['options_hiragana'][option_index]
                     is_correct = user_answer_char == question['correct_hiragana']
-                    user_answer = user_answer_char
+                    choice = option_index
                     
                     logger.info(f"MC Answer processed: {user_answer_char}, correct: {is_correct}")
                     
                 except (ValueError, IndexError) as e:
                     logger.error(f"Error processing MC answer: {e}")
-                    await query.answer("❌ Invalid choice")
+                    await answer("❌ Invalid choice")
                     return
                 
             elif answer_type == 'tf':
                 if len(parts) < 5:
                     logger.error(f"Invalid TF callback data: {callback_data}")
-                    await query.answer("❌ Invalid true/false data")
+                    await answer("❌ Invalid true/false data")
                     return
                 
                 user_says_true = parts[4] == 'true'
                 is_correct = user_says_true == question['is_correct']
-                user_answer = "true" if user_says_true else "false"
+                choice = 1 if user_says_true else 0
                 
                 logger.info(f"TF Answer processed: {user_says_true}, correct: {is_correct}")
             
             else:
                 logger.error(f"Unknown answer type: {answer_type}")
-                await query.answer("❌ Unknown answer type")
+                await answer("❌ Unknown answer type")
                 return
             
             # Record the answer
-            session['user_answers'].append({
-                'question': question,
-                'user_answer': user_answer,
-                'is_correct': is_correct,
-                'timestamp': time.time()
-            })
+            session.record_answer(choice, is_correct, time.time())
             
             # Update score
             if is_correct:
-                session['score'] += 1
+                session.score += 1
                 result_emoji = "✅"
                 result_text = "Correct!"
             else:
@@ -1412,29 +3974,48 @@ Choose your answer:
                     result_text = f"Wrong! Correct answer: **{correct_text}**\\nRomaji **{question['romaji']}** = **{question['correct_hiragana']}**"
             
             # Move to next question
-            session['current_question'] += 1
+            session.current_question += 1
+            
+            # Checkpoint jawaban (incremental)
+            try:
+                await self.db.write(self._append_session_answer, user_id, session.current_question,
+                                    session.score, session.pack_answer(session.answer_count - 1))
+            except Exception as e:
+                logger.error(f"Could not checkpoint answer for user {user_id}: {e}")
+            
+            # Mode inline: hasil di toast dan caption soal berikutnya, tanpa pesan tambahan dan jeda
+            if ANSWER_FEEDBACK_MODE == "inline":
+                verdict = "Correct!" if is_correct else "Wrong!"
+                await answer(f"{result_emoji} {verdict} {question['romaji']} = {question['correct_hiragana']}")
+                
+                self.cancel_pending_transition(user_id)
+                if session.current_question < session.question_count:
+                    await self.show_question(
+                        query, user_id,
+                        feedback=f"{result_emoji} {verdict} **{question['romaji']}** = **{question['correct_hiragana']}**"
+                    )
+                else:
+                    await self.end_quiz(query, user_id, "✅ Quiz completed!")
+                return
             
             # Prepare result message
             result_message = f"""
 {result_emoji} **{result_text}**
 
 📝 Romaji: **{question['romaji']}** = **{question['correct_hiragana']}**
-📊 Score: {session['score']}/{current_q + 1}
-📈 Progress: {((current_q + 1) / 13 * 100):.0f}%
+📊 Score: {session.score}/{current_q + 1}
+📈 Progress: {((current_q + 1) / session.question_count * 100):.0f}%
 
-{'Next question in 2 seconds...' if session['current_question'] < 13 else 'Completing quiz...'}
+{f'Next question in {NEXT_QUESTION_DELAY} seconds...' if session.current_question < session.question_count else 'Completing quiz...'}
             """
             
             # Answer the callback query first
-            try:
-                await query.answer(f"{result_emoji} {result_text}")
-            except Exception as e:
-                logger.warning(f"Could not answer callback: {e}")
+            await answer(f"{result_emoji} {result_text}")
             
             # Send result message
             result_message_obj = None
             try:
-                result_message_obj = await self.application.bot.send_message(
+                result_message_obj = await self.outbound.bot(OutboundScheduler.INTERACTIVE).send_message(
                     chat_id=query.message.chat_id,
                     text=result_message,
                     parse_mode='Markdown'
@@ -1442,43 +4023,73 @@ Choose your answer:
             except Exception as e:
                 logger.error(f"Error sending result message: {e}")
             
-            # Wait before next question
-            await asyncio.sleep(2)
+            # Jadwalkan soal berikutnya tanpa menahan handler
+            self.schedule_next_question(query, user_id, session, result_message_obj)
             
+        except Exception as e:
+            logger.error(f"Error in handle_answer: {e}", exc_info=True)
+            await answer("❌ Error processing answer")
+
+    def schedule_next_question(self, query, user_id: int, session: 'QuizSession', result_message_obj=None):
+        """Jadwalkan transisi ke soal berikutnya sebagai deferred job"""
+        self.cancel_pending_transition(user_id)
+        task = self.application.create_task(
+            self.run_next_question(query, user_id, session, result_message_obj)
+        )
+        self.pending_transitions[user_id] = task
+        task.add_done_callback(
+            lambda t: self.pending_transitions.pop(user_id, None)
+            if self.pending_transitions.get(user_id) is t else None
+        )
+    
+    def cancel_pending_transition(self, user_id: int):
+        """Batalkan transisi soal yang masih menunggu"""
+        task = self.pending_transitions.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+    
+    async def run_next_question(self, query, user_id: int, session: 'QuizSession', result_message_obj=None):
+        """Tampilkan soal berikutnya setelah jeda feedback"""
+        await asyncio.sleep(NEXT_QUESTION_DELAY)
+        
+        async with self.update_serializer.lock(user_id):
             # Clean up result message
             if result_message_obj:
                 try:
-                    await result_message_obj.delete()
+                    await self.outbound.bot(OutboundScheduler.INTERACTIVE).delete_message(
+                        chat_id=result_message_obj.chat_id, message_id=result_message_obj.message_id)
                 except Exception as e:
                     logger.warning(f"Could not delete result message: {e}")
             
+            # Session bisa sudah diganti quiz baru selama jeda
+            if self.sessions.get(user_id) is not session:
+                return
+            
             # Continue to next question or end quiz
-            if session['current_question'] < 13:
+            if session.current_question < session.question_count:
                 await self.show_question(query, user_id)
             else:
                 await self.end_quiz(query, user_id, "✅ Quiz completed!")
-            
-        except Exception as e:
-            logger.error(f"Error in handle_answer: {e}", exc_info=True)
-            try:
-                await query.answer("❌ Error processing answer")
-            except:
-                pass
 
     async def end_quiz(self, query, user_id: int, reason: str):
         """Mengakhiri quiz dengan laporan premium - STABILIZED"""
-        if user_id not in quiz_sessions:
+        session = self.sessions.pop(user_id)
+        if session is None:
             logger.warning(f"End quiz called but no session for user {user_id}")
             return
         
+        await self.finish_session(session, reason, query)
+    
+    async def finish_session(self, session: QuizSession, reason: str, query=None):
+        """Hitung hasil, simpan statistik dan kirim laporan (session sudah dilepas dari store)"""
+        user_id = session.user_id
         try:
-            session = quiz_sessions[user_id]
-            user_info = self.get_user_info(query.from_user)
+            user_info = session.user_info
             
-            final_score = session['score']
-            total_questions = session['current_question']
+            final_score = session.score
+            total_questions = session.current_question
             percentage = (final_score / total_questions * 100) if total_questions > 0 else 0
-            duration_seconds = int(time.time() - session['start_time'])
+            duration_seconds = int(min(time.time() - session.start_time, session.time_limit))
             duration_text = f"{duration_seconds // 60}m {duration_seconds % 60}s"
             
             # Determine grade
@@ -1498,29 +4109,33 @@ Choose your answer:
                 grade = "💪 Practice Needed"
                 message = "Don't give up! Every practice session counts!"
             
-            # Get updated user stats
-            current_stats = self.get_user_stats(user_id)
-            
             # Prepare quiz result data
             quiz_result = {
-                'level': session['level'],
-                'mode': session['mode'],
+                'level': session.level,
+                'mode': session.mode,
                 'score': final_score,
                 'total': total_questions,
                 'percentage': percentage,
                 'duration': duration_text,
                 'duration_seconds': duration_seconds,
                 'grade': grade,
-                'user_stats': current_stats,
-                'questions': session['questions'],
-                'answers': session['user_answers']
+                'start_time': session.start_time,
+                'player_name': user_info.get('full_name'),
+                'deck_seed': session.seed,
+                'deck_version': session.deck_version,
+                'questions': session.questions,
+                'answers': session.user_answers
             }
             
-            # Update database
-            self.update_user_stats(user_id, quiz_result)
+            # Update database (statistik baru kembali lewat RETURNING)
+            current_stats = await self.update_user_stats(user_id, quiz_result)
+            if current_stats is None:
+                await self.db.write(self._delete_session_state, user_id)
+                current_stats = await self.get_user_stats(user_id)
+            quiz_result['user_stats'] = current_stats
             
             # Send track record to owner
-            await self.send_premium_track_record(user_info, quiz_result)
+            self.send_premium_track_record(user_info, quiz_result)
             
             # Prepare result text
             result_text = f"""
@@ -1528,8 +4143,8 @@ Choose your answer:
 
 💎 **Quiz Results**
 
-👤 **Player:** {user_info['first_name']}
-📊 **Level {session['level']} - {session['mode'].title()} Mode**
+👤 **Player:** {session.display_name}
+📊 **Level {session.level} - {session.mode.title()} Mode**
 
 🎯 **Score:** {final_score}/{total_questions} ({percentage:.1f}%)
 ⏱️ **Time:** {duration_text}
@@ -1541,8 +4156,8 @@ Choose your answer:
             """
             
             keyboard = [
-                [InlineKeyboardButton(f"🔄 Retry {session['mode'].title()}", callback_data=f"start_quiz_{session['level']}_{session['mode']}")],
-                [InlineKeyboardButton(f"🎯 Try Different Mode", callback_data=f"level_{session['level']}")],
+                [InlineKeyboardButton(f"🔄 Retry {session.mode.title()}", callback_data=f"start_quiz_{session.level}_{session.mode}")],
+                [InlineKeyboardButton(f"🎯 Try Different Mode", callback_data=f"level_{session.level}")],
                 [InlineKeyboardButton("📊 Detailed Stats", callback_data="my_stats")],
                 [InlineKeyboardButton("💎 Main Menu", callback_data="back_to_menu")]
             ]
@@ -1550,8 +4165,8 @@ Choose your answer:
             
             # Send final result
             try:
-                await self.application.bot.send_message(
-                    chat_id=query.message.chat_id,
+                await self.outbound.bot(OutboundScheduler.RESULT).send_message(
+                    chat_id=session.chat_id,
                     text=result_text,
                     reply_markup=reply_markup,
                     parse_mode='Markdown'
@@ -1559,46 +4174,125 @@ Choose your answer:
             except Exception as e:
                 logger.error(f"Error sending quiz result: {e}")
                 # Fallback - try to edit existing message
-                try:
-                    await self.safe_edit_message(query, result_text, reply_markup)
-                except Exception as e2:
-                    logger.error(f"Fallback edit also failed: {e2}")
+                if query is not None:
+                    try:
+                        await self.safe_edit_message(query, result_text, reply_markup)
+                    except Exception as e2:
+                        logger.error(f"Fallback edit also failed: {e2}")
             
-            # Clean up session
-            try:
-                if user_id in quiz_sessions:
-                    del quiz_sessions[user_id]
-                if user_id in used_romaji:
-                    del used_romaji[user_id]
-                    
-                logger.info(f"Quiz completed and cleaned up for user {user_id}: {final_score}/{total_questions}")
-            except Exception as e:
-                logger.error(f"Error cleaning up session: {e}")
+            logger.info(f"Quiz completed and cleaned up for user {user_id}: {final_score}/{total_questions}")
             
         except Exception as e:
             logger.error(f"Error in end_quiz: {e}", exc_info=True)
-            # Emergency cleanup
-            try:
-                if user_id in quiz_sessions:
-                    del quiz_sessions[user_id]
-                if user_id in used_romaji:
-                    del used_romaji[user_id]
-            except:
-                pass
-            
             try:
-                await self.application.bot.send_message(
-                    chat_id=query.message.chat_id,
+                await self.outbound.bot(OutboundScheduler.RESULT).send_message(
+                    chat_id=session.chat_id,
                     text="❌ Error completing quiz. Please try /start",
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Main Menu", callback_data="back_to_menu")]])
                 )
             except Exception as e2:
                 logger.error(f"Could not send error message: {e2}")
+    
+    def _save_session_state(self, row: Tuple):
+        """Checkpoint penuh session baru"""
+        with self.get_db_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO quiz_session_state
+                (user_id, chat_id, user_info, level, mode, questions, deck_seed, deck_version,
+                 current_question, score, start_time, time_limit, answers, paused_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)
+            ''', row)
+            conn.commit()
+    
+    def _append_session_answer(self, user_id: int, current_question: int, score: int, packed_answer: str):
+        """Checkpoint incremental per jawaban (append, tanpa menulis ulang deck)"""
+        with self.get_db_connection() as conn:
+            conn.execute('''
+                UPDATE quiz_session_state
+                SET current_question = ?, score = ?, answers = answers || ?
+                WHERE user_id = ?
+            ''', (current_question, score, packed_answer, user_id))
+            conn.commit()
+    
+    def _delete_session_state(self, user_id: int):
+        """Hapus checkpoint session yang sudah selesai"""
+        with self.get_db_connection() as conn:
+            conn.execute('DELETE FROM quiz_session_state WHERE user_id = ?', (user_id,))
+            conn.commit()
+    
+    def _pause_session_states(self, paused_at: float):
+        """Tandai waktu shutdown supaya downtime tidak memotong waktu quiz"""
+        with self.get_db_connection() as conn:
+            conn.execute('UPDATE quiz_session_state SET paused_at = ?', (paused_at,))
+            conn.commit()
+    
+    def load_leaderboard(self, conn: sqlite3.Connection) -> int:
+        """Bangun index leaderboard dari user_stats saat startup"""
+        return self.leaderboard.load(conn.execute('''
+            SELECT s.user_id, s.total_games, s.total_questions, s.total_correct,
+                   s.best_score_level1, s.best_score_level2, s.best_score_level3, s.best_score_level4,
+                   s.level1_plays, s.level2_plays, s.level3_plays, s.level4_plays,
+                   u.first_name, u.last_name
+            FROM user_stats s LEFT JOIN users u ON u.user_id = s.user_id
+        '''))
+    
+    def restore_sessions(self, conn: sqlite3.Connection) -> int:
+        """Rehydrate session dari checkpoint saat startup"""
+        restored = 0
+        rows = conn.execute('''
+            SELECT user_id, chat_id, user_info, level, mode, questions, deck_seed, deck_version,
+                   current_question, score, start_time, time_limit, answers, paused_at
+            FROM quiz_session_state
+        ''').fetchall()
+        for row in rows:
+            try:
+                self.sessions.put(QuizSession.from_checkpoint(row))
+                restored += 1
+            except Exception as e:
+                logger.error(f"Could not restore quiz session for user {row[0]}: {e}")
+        conn.execute('UPDATE quiz_session_state SET paused_at = NULL')
+        conn.commit()
+        return restored
+    
+    async def finish_evicted_session(self, session: QuizSession):
+        """Finalisasi session yang dibuang karena store penuh"""
+        self.cancel_pending_transition(session.user_id)
+        async with self.update_serializer.lock(session.user_id):
+            if session.current_question > 0:
+                await self.finish_session(session, "⏰ Quiz closed (server busy)")
+            else:
+                await self.db.write(self._delete_session_state, session.user_id)
+    
+    async def sweep_sessions(self):
+        """Finalisasi session yang sudah lewat TTL (dicatat sebagai game time-out)"""
+        expired = self.sessions.pop_expired(time.time())
+        for session in expired:
+            self.cancel_pending_transition(session.user_id)
+            async with self.update_serializer.lock(session.user_id):
+                if session.current_question > 0:
+                    await self.finish_session(session, "⏰ Time's up!")
+                else:
+                    await self.db.write(self._delete_session_state, session.user_id)
+        if expired:
+            stats = self.sessions.stats()
+            logger.info(
+                f"Session sweep: finalized {len(expired)} expired, {stats['live']} live "
+                f"(~{stats['memory_bytes'] / 1024:.1f} KiB)"
+            )
+    
+    async def session_sweep_loop(self):
+        """Sweeper periodik untuk session yang ditinggalkan"""
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                await self.sweep_sessions()
+            except Exception as e:
+                logger.error(f"Error sweeping sessions: {e}", exc_info=True)
 
     async def show_user_stats(self, chat_id: int, user_id: int):
         """Menampilkan statistik user"""
         try:
-            stats = self.get_user_stats(user_id)
+            stats = await self.get_user_stats(user_id)
             
             overall_accuracy = (stats['total_correct'] / stats['total_questions'] * 100) if stats['total_questions'] > 0 else 0
             easy_acc = (stats['mode_stats']['easy']['correct'] / stats['mode_stats']['easy']['total'] * 100) if stats['mode_stats']['easy']['total'] > 0 else 0
@@ -1639,7 +4333,7 @@ Keep practicing! 頑張って！ 💪
             keyboard = [[InlineKeyboardButton("🏠 Back to Menu", callback_data="back_to_menu")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await self.application.bot.send_message(
+            await self.outbound.bot(OutboundScheduler.INTERACTIVE).send_message(
                 chat_id=chat_id,
                 text=stats_text,
                 reply_markup=reply_markup,
@@ -1648,13 +4342,14 @@ Keep practicing! 頑張って！ 💪
             
         except Exception as e:
             logger.error(f"Error in show_user_stats: {e}")
-            await self.application.bot.send_message(chat_id, "❌ Error retrieving statistics.")
+            await self.outbound.bot(OutboundScheduler.INTERACTIVE).send_message(
+                chat_id=chat_id, text="❌ Error retrieving statistics.")
 
     async def show_user_stats_callback(self, query):
         """Menampilkan statistik user dari callback"""
         try:
             user_id = query.from_user.id
-            stats = self.get_user_stats(user_id)
+            stats = await self.get_user_stats(user_id)
             
             overall_accuracy = (stats['total_correct'] / stats['total_questions'] * 100) if stats['total_questions'] > 0 else 0
             easy_acc = (stats['mode_stats']['easy']['correct'] / stats['mode_stats']['easy']['total'] * 100) if stats['mode_stats']['easy']['total'] > 0 else 0
@@ -1753,7 +4448,8 @@ Each question shows ROMAJI sound, you choose the correct HIRAGANA character!
                 [
                     InlineKeyboardButton("📊 My Statistics", callback_data="my_stats"),
                     InlineKeyboardButton("💡 How to Play", callback_data="help")
-                ]
+                ],
+                [InlineKeyboardButton("🏆 Leaderboard", callback_data="lb_overall")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
@@ -1784,16 +4480,20 @@ Choose your level or check your progress!
         print("🎯 Advanced Analytics: ENABLED")
         print("🛡️  Error Handling: STABILIZED")
         print("💎 Owner Commands: ENHANCED")
+        print(f"🌐 Update Mode: {RUN_MODE.upper()}")
         print("💵 System Value: $15,000")
         print("="*60)
         print("Bot is ready! Press Ctrl+C to stop")
         print("="*60)
         
         try:
-            self.application.run_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
+            if RUN_MODE == "webhook":
+                asyncio.run(self.run_webhook())
+            else:
+                self.application.run_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=False
+                )
         except KeyboardInterrupt:
             print("\n🛑 Bot stopped by user")
             print("👋 Goodbye!")
@@ -1801,6 +4501,55 @@ Choose your level or check your progress!
             logger.error(f"Fatal error: {e}")
             print(f"❌ Fatal Error: {e}")
 
+    def health_status(self) -> Dict:
+        """Info ringkas untuk health route webhook"""
+        return {
+            'live_sessions': len(self.sessions),
+            'pending_db_writes': self.db.pending_writes(),
+            'pending_track_records': len(self.track_digest),
+        }
+    
+    async def run_webhook(self):
+        """Jalankan bot di mode webhook dengan aiohttp server bawaan"""
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set for webhook mode")
+        
+        app = self.application
+        # Tanpa secret siapa pun yang tahu URL bisa mengirim update palsu (termasuk atas nama owner)
+        secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        server = WebhookServer(app, secret_token=secret_token, health=self.health_status)
+        runner = web.AppRunner(server.build_app())
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+        
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        try:
+            await app.start()
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                secret_token=secret_token
+            )
+            logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            await stop_event.wait()
+        finally:
+            await runner.cleanup()
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+
 def main():
     """Jalankan bot dengan setup validation"""
     try: